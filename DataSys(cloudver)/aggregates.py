@@ -0,0 +1,135 @@
+"""Aggregates behind the overview dashboard.
+
+The KPI metrics and every breakdown are defined once below and can be
+computed two ways with identical results: ``overview_sql`` runs them as
+grouped queries in the warehouse (or the local DuckDB stand-in) so only
+the small result sets come back, and ``overview_pandas`` computes them from
+the shared admissions frame.
+"""
+import os
+import time
+
+import pandas as pd
+import streamlit as st
+
+from backend import get_backend
+from concurrent_load import load_all
+from dataset import get_dataset
+from derived import AGE_LABELS, RACE_GROUPS, age_group_sql, race_group_sql
+
+
+# 'sql' aggregates in the warehouse, 'pandas' on the preloaded admissions frame
+AGGREGATION = os.environ.get('HEARTTRACK_AGGREGATION', 'sql')
+
+KPI_COLUMNS = ['age', 'length_of_stay', 'lace_score', 'cci_score']
+
+GENDER_LABELS = {'M': 'Male', 'F': 'Female'}
+GENDER_SQL = "CASE gender WHEN 'M' THEN 'Male' WHEN 'F' THEN 'Female' ELSE gender END"
+
+# dimension -> (SQL expression, id counted distinctly, category order or None for sorted)
+BREAKDOWNS = {
+    'Hospital': ('Hospital', 'admission_id', None),
+    'admission_location': ('admission_location', 'admission_id', None),
+    'admission_type': ('admission_type', 'admission_id', None),
+    'discharge_location': ('discharge_location', 'admission_id', None),
+    'gender': (GENDER_SQL, 'patient_id', None),
+    'age_group': (age_group_sql('age'), 'patient_id', AGE_LABELS),
+    'race_grouped': (race_group_sql('race'), 'patient_id', RACE_GROUPS),
+}
+# breakdowns drawn with every category, empty ones as zero bars, like the
+# pd.cut age bands always were (the other dimensions list only what occurs)
+ALL_CATEGORIES = ['age_group']
+
+
+class Overview:
+    """KPI values and per-dimension distinct counts of the overview dashboard
+
+    ``version`` tells the results of different computations apart, so charts
+    built from one are never reused for another.
+    """
+
+    def __init__(self, kpis, counts, version=None):
+        self.kpis = kpis
+        self.counts = counts
+        self.version = time.time() if version is None else version
+
+    def breakdown(self, dimension, name):
+        """Counts of one dimension as a frame with columns [dimension, name]"""
+        counts = self.counts[dimension]
+        return pd.DataFrame({dimension: counts.index, name: counts.to_numpy()})
+
+
+def kpi_sql():
+    means = ', '.join(f'AVG({col}) AS {col}' for col in KPI_COLUMNS)
+    return f"""
+        SELECT COUNT(DISTINCT patient_id) AS patients, COUNT(DISTINCT admission_id) AS admissions, {means}
+        FROM {{admissions_enriched}}
+    """
+
+
+def breakdown_sql():
+    """Every breakdown in one query, as (dimension, value, n) rows"""
+    return '\nUNION ALL\n'.join(
+        f"""
+        SELECT '{dimension}' AS dimension, CAST({expr} AS STRING) AS value, COUNT(DISTINCT {count}) AS n
+        FROM {{admissions_enriched}}
+        WHERE ({expr}) IS NOT NULL
+        GROUP BY value
+        """
+        for dimension, (expr, count, _) in BREAKDOWNS.items()
+    )
+
+
+def sorted_counts(values, counts, order, all_categories=False):
+    """Counts indexed by value, in the order pandas groupby would return them"""
+    index = pd.CategoricalIndex(values, categories=order) if order else pd.Index(values)
+    counts = pd.Series(counts, index=index).sort_index(kind='stable')
+    if all_categories:
+        # the query only returns bands that occur
+        counts = counts.reindex(pd.CategoricalIndex(order, categories=order), fill_value=0)
+    return counts
+
+
+def overview_sql():
+    """Overview aggregates computed by the backend, only the results are transferred"""
+    backend = get_backend()
+    # both queries are in flight at once, so this waits for the slower one only
+    results, _ = load_all({'kpis': (backend.query, kpi_sql()), 'breakdowns': (backend.query, breakdown_sql())})
+    result, rows = results['kpis'], results['breakdowns']
+    kpis = pd.Series({col: result[col].iloc[0] for col in result}, dtype=object)
+    counts = {}
+    for dimension, (_, _, order) in BREAKDOWNS.items():
+        part = rows[rows['dimension'] == dimension]
+        counts[dimension] = sorted_counts(
+            part['value'].to_numpy(), part['n'].to_numpy(), order, dimension in ALL_CATEGORIES,
+        )
+    return Overview(kpis, counts)
+
+
+def overview_pandas(admissions, version=None):
+    """The same aggregates computed from the admissions frame"""
+    kpis = pd.Series({
+        'patients': admissions['patient_id'].nunique(),
+        'admissions': admissions['admission_id'].nunique(),
+        **{col: admissions[col].mean() for col in KPI_COLUMNS},
+    }, dtype=object)
+    counts = {}
+    for dimension, (_, count, _) in BREAKDOWNS.items():
+        values = admissions[dimension]
+        if dimension == 'gender':
+            values = values.replace(GENDER_LABELS)
+        counts[dimension] = admissions.groupby(values, observed=dimension not in ALL_CATEGORIES)[count].nunique()
+    return Overview(kpis, counts, version)
+
+
+@st.cache_data(ttl=3600)
+def cached_overview_sql():
+    return overview_sql()
+
+
+def get_overview():
+    """Overview aggregates in the configured AGGREGATION mode"""
+    if AGGREGATION == 'pandas':
+        dataset = get_dataset()
+        return overview_pandas(dataset.admissions, dataset.version)
+    return cached_overview_sql()
@@ -3,28 +3,33 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from backend import get_backend, select_sql
+from search_index import IdIndex
 
 #config 
 st.set_page_config(page_title="HeartTrack Dashboard", layout="wide")
 
-# Connect to BigQuery
-sa_info = st.secrets["gcp_service_account"]
-credentials = service_account.Credentials.from_service_account_info(sa_info)
-client = bigquery.Client(credentials=credentials, project=sa_info["project_id"])
+# admissions columns used by the pages below
+COLUMNS = [
+    "patient_id", "age", "gender", "admission_type", "length_of_stay",
+    "diagnosis_description", "cci_score", "lace_score",
+]
 
 # load the fact tables
 @st.cache_data(ttl=3600)
 def load_admissions():
     """Load latest admission record per patient"""
-    query = """
-    SELECT AS VALUE
-      ARRAY_AGG(adm ORDER BY adm.admittime DESC LIMIT 1)[OFFSET(0)]
-    FROM `datasystemsmimic.datasystems_final.admissions_enriched` adm
-    GROUP BY adm.patient_id
-    """
-    return client.query(query).to_dataframe()
+    query = select_sql("admissions_enriched", COLUMNS, """
+    WHERE TRUE
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY admittime DESC) = 1
+    """)
+    return get_backend().query(query)
+
+@st.cache_resource(ttl=3600)
+def load_patient_search():
+    """Latest admissions with a patient id search index over them, shared by all sessions"""
+    df = load_admissions()
+    return df, IdIndex(df.patient_id)
 
 # Pages
 def show_dashboard():
@@ -90,12 +95,12 @@ def show_dashboard():
 def show_patient_list():
     """Page for searching and listing patients."""
     st.title("Patient List")
-    df = load_admissions()
+    df, id_index = load_patient_search()
 
     # Search box
     search = st.text_input("Search Patient ID")
     if search:
-        df = df[df.patient_id.astype(str).str.contains(search)]
+        df = df.iloc[id_index.contains(search)]
 
     # Quick filters
     st.markdown("**Quick Filters:**")
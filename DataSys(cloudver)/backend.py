@@ -0,0 +1,205 @@
+"""Query backends for the cloud dashboard.
+
+Queries are written once in BigQuery SQL with ``{table}`` placeholders and
+``@name`` parameters. ``BigQueryBackend`` runs them in the warehouse and
+``DuckDBBackend`` runs the same text over the local CSV/Parquet tables, so
+every query path can be tried offline (``HEARTTRACK_BACKEND=local``).
+Both return results as Arrow tables, which convert to pandas column by
+column instead of row by row through Python objects.
+
+``get_backend`` hands out one backend per server process, so credentials
+and pooled HTTP connections are reused by every session and rerun. Unless
+``HEARTTRACK_CACHE=off`` it is wrapped in a ``CachedBackend`` that serves
+repeated queries from the on-disk result cache.
+"""
+import os
+import re
+import threading
+
+import numpy as np
+
+from result_cache import ResultCache
+
+
+DATASET = 'datasystemsmimic.datasystems_final'
+
+# local stand-ins for the warehouse tables
+LOCAL_TABLES_DIR = os.environ.get('HEARTTRACK_TABLES', os.path.join('..', 'DataSys(local)', 'tables'))
+LOCAL_TABLES = {
+    'admissions_enriched': 'fact_admissions',
+    'fact_vitals': 'fact_vitals',
+    'fact_lab_results': 'fact_lab_results',
+}
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+# concurrent HTTP connections kept open to the BigQuery API
+POOL_SIZE = 16
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process-wide backend, built on first use
+
+    ``HEARTTRACK_BACKEND=local`` selects the DuckDB stand-in, anything else
+    BigQuery with the service account from ``st.secrets``.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if os.environ.get('HEARTTRACK_BACKEND') == 'local':
+                backend = DuckDBBackend()
+            else:
+                import streamlit as st
+                backend = BigQueryBackend(*bigquery_clients(st.secrets["gcp_service_account"]))
+            if os.environ.get('HEARTTRACK_CACHE') != 'off':
+                backend = CachedBackend(backend, ResultCache())
+            _backend = backend
+        return _backend
+
+
+def set_backend(backend):
+    """Swap in another backend, e.g. a DuckDBBackend over test tables"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def bigquery_clients(service_account_info, pool_size=POOL_SIZE):
+    """BigQuery client whose HTTP session keeps ``pool_size`` connections alive
+
+    Also returns a BigQuery Storage read client for Arrow result downloads,
+    or None when google-cloud-bigquery-storage is not installed.
+    """
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import bigquery
+    from google.oauth2 import service_account
+    from requests.adapters import HTTPAdapter
+
+    credentials = service_account.Credentials.from_service_account_info(
+        service_account_info, scopes=bigquery.Client.SCOPE
+    )
+    session = AuthorizedSession(credentials)
+    session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    client = bigquery.Client(project=credentials.project_id, credentials=credentials, _http=session)
+    try:
+        from google.cloud import bigquery_storage
+        bqstorage = bigquery_storage.BigQueryReadClient(credentials=credentials)
+    except ImportError:
+        bqstorage = None
+    return client, bqstorage
+
+
+def select_sql(table, columns, clauses=''):
+    """SELECT of only the given columns (first mention wins) from a ``{table}``"""
+    columns = ', '.join(dict.fromkeys(columns))
+    return f'SELECT {columns} FROM {{{table}}} {clauses}'.strip()
+
+
+class BigQueryBackend:
+    """Runs parameterized queries with a ``bigquery.Client``"""
+
+    def __init__(self, client, bqstorage=None):
+        self.client = client
+        self.bqstorage = bqstorage
+        self.name = f'bigquery:{DATASET}'
+
+    def table(self, name):
+        return f'`{DATASET}.{name}`'
+
+    def query(self, sql, params=None):
+        return self.query_arrow(sql, params).to_pandas()
+
+    def query_arrow(self, sql, params=None):
+        """Query result as an Arrow table, read through the Storage API when available"""
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter(name, param_type(value), value)
+            for name, value in (params or {}).items()
+        ])
+        sql = PLACEHOLDER.sub(lambda m: self.table(m.group(1)), sql)
+        job = self.client.query(sql, job_config=job_config)
+        return job.to_arrow(bqstorage_client=self.bqstorage, create_bqstorage_client=False)
+
+
+class DuckDBBackend:
+    """Runs the same queries in-process over the local tables"""
+
+    def __init__(self, tables_dir=LOCAL_TABLES_DIR):
+        import duckdb
+
+        self.con = duckdb.connect()
+        self.name = f'duckdb:{os.path.abspath(tables_dir)}'
+        for name, file in LOCAL_TABLES.items():
+            parquet = os.path.join(tables_dir, f'{file}.parquet')
+            csv = os.path.join(tables_dir, f'{file}.csv')
+            if os.path.exists(parquet):
+                source = f"read_parquet('{parquet}')"
+            elif os.path.exists(csv):
+                source = f"read_csv_auto('{csv}')"
+            else:
+                continue
+            self.con.execute(f'CREATE VIEW {name} AS SELECT * FROM {source}')
+        # BigQuery functions the queries use that duckdb spells differently
+        self.con.execute('CREATE MACRO regexp_contains(value, pattern) AS regexp_matches(value, pattern)')
+        self.con.execute('CREATE MACRO div(a, b) AS a // b')
+        self.con.execute('CREATE MACRO unix_seconds(ts) AS CAST(floor(epoch(ts)) AS BIGINT)')
+        self.con.execute('CREATE MACRO timestamp_seconds(seconds) AS make_timestamp(seconds * 1000000)')
+
+    def table(self, name):
+        return name
+
+    def query(self, sql, params=None):
+        return self.query_arrow(sql, params).to_pandas()
+
+    def query_arrow(self, sql, params=None):
+        sql = PLACEHOLDER.sub(lambda m: self.table(m.group(1)), sql)
+        # duckdb spells named parameters $name
+        sql = re.sub(r'@(\w+)', r'$\1', sql)
+        params = {name: to_python(value) for name, value in (params or {}).items()}
+        # one cursor per query, a duckdb connection is not shared across threads
+        with self.con.cursor() as cursor:
+            return cursor.execute(sql, params).fetch_arrow_table()
+
+
+class CachedBackend:
+    """Serves repeated queries of another backend from a ``ResultCache``"""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+
+    def table(self, name):
+        return self.backend.table(name)
+
+    def query(self, sql, params=None):
+        return self.query_arrow(sql, params).to_pandas()
+
+    def query_arrow(self, sql, params=None):
+        params = {name: to_python(value) for name, value in (params or {}).items()}
+        key = self.cache.key(self.name, sql, params)
+        table = self.cache.get(key)
+        if table is None:
+            table = self.backend.query_arrow(sql, params)
+            self.cache.put(key, table)
+        return table
+
+
+def to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def param_type(value):
+    """BigQuery type name of a scalar query parameter"""
+    value = to_python(value)
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    return 'STRING'
@@ -0,0 +1,55 @@
+"""Concurrent loading of the dashboard's tables at startup.
+
+``load_all`` submits every table load at once and returns when all of them
+have finished, so startup takes about as long as the slowest load instead
+of the sum of them. Warehouse queries spend their time waiting on the
+network and run on threads; CSV parsing holds the GIL, so it runs in worker
+processes instead, as many as there are cores. Each load's wall time is
+logged and returned.
+"""
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# workers start from a clean interpreter rather than a fork of the Streamlit
+# server, whose threads and locks a fork would copy mid-use
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def timed(load, *args):
+    """``load(*args)`` and the seconds it took"""
+    start = time.perf_counter()
+    result = load(*args)
+    return result, time.perf_counter() - start
+
+
+def load_all(loads, processes=False):
+    """Run ``{name: (function, *args)}`` concurrently, returns ({name: result}, {name: seconds})
+
+    With ``processes=True`` the functions, their arguments and results must
+    be picklable. Each worker's DataFrame is pickled back to the parent, so
+    peak memory briefly doubles for the largest table (vitals) while it is
+    copied. On a single core the loads run on threads instead, since worker
+    processes would only add their start-up and transfer costs.
+    """
+    cores = os.cpu_count() or 1
+    if processes and cores > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=min(len(loads), cores), mp_context=multiprocessing.get_context(START_METHOD),
+        )
+    else:
+        executor = ThreadPoolExecutor(max_workers=max(len(loads), 1))
+    start = time.perf_counter()
+    results, seconds = {}, {}
+    with executor as pool:
+        futures = {name: pool.submit(timed, *load) for name, load in loads.items()}
+        for name, future in futures.items():
+            results[name], seconds[name] = future.result()
+            logger.info('loaded %s in %.2fs', name, seconds[name])
+    logger.info('loaded %s in %.2fs overall', ', '.join(loads), time.perf_counter() - start)
+    return results, seconds
@@ -0,0 +1,262 @@
+"""Process-wide dataset shared by every browser session.
+
+``get_dataset`` is cached with ``st.cache_resource`` so the admissions table
+is held once per server process instead of once per session. Pages must
+treat the shared frames as read-only and keep only small filters in
+``st.session_state``. Vitals and labs are never loaded whole: the patient
+chart queries one patient's latest rows when it opens, and its full history
+as rollups the warehouse aggregates for the charted window.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from backend import CachedBackend, get_backend, select_sql
+from concurrent_load import load_all
+from derived import add_derived_columns
+from figure_cache import get_figure_cache
+from patient_list import PatientList
+from rollups import DAILY, ROLLUP_LEVELS, choose_level, span, window_count
+
+
+# admissions columns each page reads, only their union is queried
+DASHBOARD_COLUMNS = [
+    'patient_id', 'admission_id', 'Hospital', 'admission_location', 'admission_type',
+    'discharge_location', 'gender', 'age', 'length_of_stay', 'lace_score', 'cci_score',
+]
+PAGE_COLUMNS = {
+    'main.py': DASHBOARD_COLUMNS,
+    'pages/byhospital.py': DASHBOARD_COLUMNS,
+    'pages/patientlist.py': [
+        'Hospital', 'patient_id', 'age', 'gender', 'diagnosis_description',
+        'length_of_stay', 'lace_score', 'cci_score',
+    ],
+    'pages/patientchart.py': ['patient_id', 'gender', 'age', 'length_of_stay', 'diagnosis_description'],
+}
+# inputs of the derived age_group / race_grouped columns
+DERIVED_INPUTS = ['age', 'race']
+ADMISSIONS_COLUMNS = [col for cols in [*PAGE_COLUMNS.values(), DERIVED_INPUTS] for col in cols]
+
+
+# rows per vital / lab type shown on the patient chart
+LATEST_N = int(os.environ.get('HEARTTRACK_LATEST_N', 10))
+
+# one patient's latest N rows per measurement, filtered and windowed in the warehouse
+LATEST_ROWS_QUERIES = {
+    'vitals': """
+        SELECT * FROM {fact_vitals}
+        WHERE patient_id = @pid
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY vital_name ORDER BY vital_time DESC) <= @n
+        ORDER BY vital_name, vital_time DESC
+    """,
+    'labs': """
+        SELECT * FROM {fact_lab_results}
+        WHERE patient_id = @pid
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY lab_type_name ORDER BY lab_time DESC) <= @n
+        ORDER BY lab_type_name, lab_time DESC
+    """,
+}
+
+# how long query results stay cached, charts built from them are kept as long
+QUERY_TTL_SECONDS = 600
+TIME_COLUMNS = {'vitals': 'vital_time', 'labs': 'lab_time'}
+# bounds of a window with no start / end, in seconds since the epoch
+OPEN_START, OPEN_END = -2 ** 62, 2 ** 62
+
+# one patient's rows in [@start, @end) seconds since the epoch, for the full-history charts
+PATIENT_ROWS_QUERIES = {
+    'vitals': """
+        SELECT * FROM {fact_vitals}
+        WHERE patient_id = @pid
+        AND UNIX_SECONDS(CAST(vital_time AS TIMESTAMP)) >= @start
+        AND UNIX_SECONDS(CAST(vital_time AS TIMESTAMP)) < @end
+        ORDER BY vital_name, vital_time
+    """,
+    'labs': """
+        SELECT * FROM {fact_lab_results}
+        WHERE patient_id = @pid
+        AND UNIX_SECONDS(CAST(lab_time AS TIMESTAMP)) >= @start
+        AND UNIX_SECONDS(CAST(lab_time AS TIMESTAMP)) < @end
+        ORDER BY lab_type_name, lab_time
+    """,
+}
+
+# the same window rolled up into @width-second buckets, like the local rollups (see rollups.py)
+ROLLUP_QUERIES = {
+    'vitals': """
+        SELECT measure, TIMESTAMP_SECONDS(DIV(seconds, @width) * @width) AS time,
+            MIN(value) AS min, MAX(value) AS max, SUM(value) AS sum, COUNT(value) AS count
+        FROM (
+            SELECT vital_name AS measure, UNIX_SECONDS(CAST(vital_time AS TIMESTAMP)) AS seconds,
+                vital_reading AS value
+            FROM {fact_vitals}
+            WHERE patient_id = @pid AND vital_reading IS NOT NULL
+        )
+        WHERE seconds >= @start AND seconds < @end
+        GROUP BY measure, time
+        ORDER BY measure, time
+    """,
+    'labs': """
+        SELECT measure, TIMESTAMP_SECONDS(DIV(seconds, @width) * @width) AS time,
+            MIN(value) AS min, MAX(value) AS max, SUM(value) AS sum, COUNT(value) AS count
+        FROM (
+            SELECT lab_type_name AS measure, UNIX_SECONDS(CAST(lab_time AS TIMESTAMP)) AS seconds,
+                lab_value AS value
+            FROM {fact_lab_results}
+            WHERE patient_id = @pid AND lab_value IS NOT NULL
+        )
+        WHERE seconds >= @start AND seconds < @end
+        GROUP BY measure, time
+        ORDER BY measure, time
+    """,
+}
+
+
+class Dataset:
+    """Read-only admissions table shared across sessions"""
+
+    def __init__(self, admissions):
+        self.admissions = admissions
+        # load time, so charts built from an earlier load are never reused
+        self.version = time.time()
+        self.patient_list = PatientList(admissions)
+        self.nbytes = {name: object_bytes(df) for name, df in self.tables().items()}
+        self.nbytes['patient list'] = self.patient_list.nbytes
+
+    def tables(self):
+        return {'admissions': self.admissions}
+
+
+@st.cache_resource
+def get_dataset():
+    """Query the admissions table once for the whole process"""
+    # vitals and labs are queried per patient, admissions is the only table loaded up front
+    tables, _ = load_all({'admissions': (get_backend().query, select_sql('admissions_enriched', ADMISSIONS_COLUMNS))})
+    return Dataset(add_derived_columns(tables['admissions']))
+
+
+@st.cache_data(ttl=QUERY_TTL_SECONDS, max_entries=256)
+def latest_patient_rows(name, pid, n=LATEST_N):
+    """One patient's latest ``n`` vitals or labs per measurement, newest first"""
+    return get_backend().query(LATEST_ROWS_QUERIES[name], {'pid': int(pid), 'n': n})
+
+
+def epoch_seconds(t, default):
+    return default if t is None else int(pd.Timestamp(t).timestamp())
+
+
+def naive_utc(times):
+    """Times as naive UTC, whether the warehouse returned them with a time zone or not"""
+    return times.dt.tz_convert(None) if times.dt.tz is not None else times
+
+
+@st.cache_data(ttl=QUERY_TTL_SECONDS, max_entries=32)
+def patient_rows(name, pid, start=None, end=None):
+    """One patient's vitals or labs rows in [start, end), oldest first per measurement"""
+    params = {'pid': int(pid), 'start': epoch_seconds(start, OPEN_START), 'end': epoch_seconds(end, OPEN_END)}
+    rows = get_backend().query(PATIENT_ROWS_QUERIES[name], params)
+    rows[TIME_COLUMNS[name]] = naive_utc(rows[TIME_COLUMNS[name]])
+    return rows
+
+
+@st.cache_data(ttl=QUERY_TTL_SECONDS, max_entries=256)
+def patient_rollup(name, pid, level, start=None, end=None):
+    """One patient's vitals or labs buckets at one rollup level over [start, end)"""
+    params = {
+        'pid': int(pid),
+        'width': int(ROLLUP_LEVELS[level].total_seconds()),
+        'start': epoch_seconds(start, OPEN_START),
+        'end': epoch_seconds(end, OPEN_END),
+    }
+    rollup = get_backend().query(ROLLUP_QUERIES[name], params)
+    rollup['time'] = naive_utc(rollup['time'])
+    return rollup
+
+
+def time_span(pid):
+    """[first, last) day with any of the patient's vitals or labs, None if there are none"""
+    spans = [span(patient_rollup(name, pid, DAILY)) for name in ROLLUP_QUERIES]
+    spans = [s for s in spans if s is not None]
+    if not spans:
+        return None
+    return min(start for start, _ in spans), max(end for _, end in spans)
+
+
+def history(name, pid, start, end):
+    """(level, rows) charting one patient's vitals or labs over [start, end)
+
+    The raw rows (level None) when few enough fall in the window,
+    otherwise the buckets of the rollup level that fits it, aggregated by
+    the warehouse.
+    """
+    level = choose_level(start, end, window_count(patient_rollup(name, pid, DAILY), start, end))
+    if level is None:
+        return None, patient_rows(name, pid, start, end)
+    return level, patient_rollup(name, pid, level, start, end)
+
+
+def object_bytes(obj):
+    """Approximate bytes held by a session_state value"""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    return sys.getsizeof(obj)
+
+
+def session_bytes():
+    """Bytes this session holds on top of the shared dataset"""
+    shared = {id(obj) for obj in get_dataset().tables().values()}
+    return sum(
+        object_bytes(value)
+        for value in st.session_state.to_dict().values()
+        if id(value) not in shared
+    )
+
+
+def format_bytes(n):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if n < 1024 or unit == 'GB':
+            return f'{n:,.0f} {unit}' if unit == 'B' else f'{n:,.1f} {unit}'
+        n /= 1024
+
+
+def show_memory_gauge():
+    """Sidebar gauge of the shared data size and what this session adds"""
+    dataset = get_dataset()
+    with st.sidebar:
+        st.caption('Memory usage')
+        col1, col2 = st.columns(2)
+        col1.metric('Shared data', format_bytes(sum(dataset.nbytes.values())))
+        col2.metric('This session', format_bytes(session_bytes()))
+        with st.expander('Shared tables'):
+            for name, n in dataset.nbytes.items():
+                st.write(f'**{name}:** {format_bytes(n)}')
+    show_query_cache()
+    show_figure_cache()
+
+
+def show_query_cache():
+    """Sidebar counters of the on-disk query result cache"""
+    backend = get_backend()
+    if not isinstance(backend, CachedBackend):
+        return
+    stats = backend.cache.stats()
+    with st.sidebar.expander('Query cache'):
+        st.write(f"**Hits / misses:** {stats['hits']:,} / {stats['misses']:,}")
+        st.write(f"**Bytes saved:** {format_bytes(stats['bytes_saved'])}")
+        st.write(f"**Stored:** {stats['entries']:,} results, {format_bytes(stats['bytes'])}")
+
+
+def show_figure_cache():
+    """Sidebar counters of the shared figure cache"""
+    figures = get_figure_cache()
+    with st.sidebar.expander('Figure cache'):
+        st.write(f"**Hits / misses:** {figures.hits:,} / {figures.misses:,}")
+        st.write(f"**Stored:** {len(figures):,} entries, {format_bytes(figures.nbytes)} of {format_bytes(figures.max_bytes)}")
@@ -1,20 +1,15 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as pxpress
+from dataset import get_dataset, show_memory_gauge
+from figure_cache import get_figure_cache
 
 
-if 'admissions' not in st.session_state:
-    admissions = st.session_state.admissions
-    vitals = st.session_state.vitals
-    labs = st.session_state.labs
+dataset = get_dataset()
+admissions_full = dataset.admissions
+show_memory_gauge()
 
-
-
-
-admissions_full = st.session_state.admissions
-
-hospital_list = admissions_full["Hospital"].dropna().unique()
-hospital_list.sort()
+hospital_list = sorted(admissions_full["Hospital"].dropna().unique())
 selected_hospital = st.selectbox("Select a Hospital", options=hospital_list)
 
 admissions = admissions_full[admissions_full["Hospital"] == selected_hospital]
@@ -29,14 +24,16 @@ col4.metric('Average Length of Stay', round(admissions['length_of_stay'].mean(),
 col5.metric('Average LACE Score', round(admissions['lace_score'].mean(), 2))
 col6.metric('Average CCI Score', round(admissions['cci_score'].mean(), 2))
 
-admitted_from = admissions.groupby('admission_location')['admission_id'].nunique().reset_index(name='Number of Admissions From Location')
-admissions_by_type = admissions.groupby('admission_type')['admission_id'].nunique().reset_index(name='Number of Admissions Per Type')
-discharge_locations = admissions.groupby('discharge_location')['admission_id'].nunique().reset_index(name='Number of Admissions Per Discharge Location')
+#charts are built once per hospital and data version, and shared by every session
+figures = get_figure_cache()
 
-st.subheader("Admissions Overview")
-col7, col8, col9 = st.columns(3)
 
-with col7:
+def chart(chart_id, build):
+    return figures.figure(('byhospital', chart_id, (selected_hospital,), dataset.version), build)
+
+
+def location_chart():
+    admitted_from = admissions.groupby('admission_location')['admission_id'].nunique().reset_index(name='Number of Admissions From Location')
     admitted_from_sorted = admitted_from.sort_values("Number of Admissions From Location", ascending=False)
     fig1 = pxpress.bar(
         admitted_from_sorted,
@@ -49,9 +46,11 @@ with col7:
     )
     fig1.update_layout(yaxis_title="Admission Location", xaxis_title="Admissions", showlegend=False)
     fig1.update_traces(width=0.8)
-    st.plotly_chart(fig1, use_container_width=True)
+    return fig1
 
-with col8:
+
+def type_chart():
+    admissions_by_type = admissions.groupby('admission_type')['admission_id'].nunique().reset_index(name='Number of Admissions Per Type')
     admissions_by_type_sorted = admissions_by_type.sort_values("Number of Admissions Per Type", ascending=False)
     fig2 = pxpress.bar(
         admissions_by_type_sorted,
@@ -64,9 +63,11 @@ with col8:
     )
     fig2.update_layout(yaxis_title="Admission Type", xaxis_title="Admissions", showlegend=False)
     fig2.update_traces(width=0.8)
-    st.plotly_chart(fig2, use_container_width=True)
+    return fig2
 
-with col9:
+
+def discharge_chart():
+    discharge_locations = admissions.groupby('discharge_location')['admission_id'].nunique().reset_index(name='Number of Admissions Per Discharge Location')
     discharge_locations_sorted = discharge_locations.sort_values("Number of Admissions Per Discharge Location", ascending=False)
     fig3 = pxpress.bar(
         discharge_locations_sorted,
@@ -79,58 +80,32 @@ with col9:
     )
     fig3.update_layout(yaxis_title="Discharge Location", xaxis_title="Admissions", showlegend=False)
     fig3.update_traces(width=0.8)
-    st.plotly_chart(fig3, use_container_width=True)
-
-    #create demongraphcs
-pt_by_gender = (
-    admissions.replace({'gender': {'M': 'Male', 'F': 'Female'}})
-    .groupby('gender')['patient_id']
-    .nunique()
-    .reset_index(name='Number of Patients')
-    .rename(columns={'gender': 'Gender'})
-)
-
-pt_by_age_group = (
-    admissions.assign(
-        age_group=pd.cut(
-            admissions["age"],
-            bins=[0, 20, 40, 60, 80, 100],
-            labels=["<20", "21–40", "41–60", "61–80", "81–100"],
-            right=False
-        )
-    )
-    .groupby("age_group")["patient_id"]
-    .nunique()
-    .reset_index(name="Number of Patients")
-    .rename(columns={"age_group": "Age Group"})
-)
+    return fig3
 
-#Need to group the races because tehre are too many categories
-admissions['race_grouped'] = 'Other'
 
-admissions.loc[admissions['race'].str.contains('WHITE', case=False, na=False), 'race_grouped'] = 'White'
-admissions.loc[admissions['race'].str.contains('BLACK', case=False, na=False), 'race_grouped'] = 'Black'
-admissions.loc[admissions['race'].str.contains('ASIAN', case=False, na=False), 'race_grouped'] = 'Asian'
-admissions.loc[admissions['race'].str.contains('HISPANIC', case=False, na=False), 'race_grouped'] = 'Hispanic'
-admissions.loc[admissions['race'].str.contains('UNKNOWN|UNABLE', case=False, na=False), 'race_grouped'] = 'Unknown'
+st.subheader("Admissions Overview")
+col7, col8, col9 = st.columns(3)
 
-pt_by_race = (
-    admissions.groupby('race_grouped')['patient_id']
-    .nunique()
-    .reset_index(name='Number of Patients')
-    .rename(columns={'race_grouped': 'Race'})
-)
+with col7:
+    st.plotly_chart(chart('location', location_chart), use_container_width=True)
 
+with col8:
+    st.plotly_chart(chart('type', type_chart), use_container_width=True)
 
-#visualise patient demographics
-st.subheader("Patient Demographics")
+with col9:
+    st.plotly_chart(chart('discharge', discharge_chart), use_container_width=True)
 
-# Create 2 columns for charts
-col11, col12, col13= st.columns(3)
 
-# gender pie chart
-with col11:
-    gender_chart = pxpress.pie(
+#create demongraphcs
+def gender_chart():
+    pt_by_gender = (
+        admissions.replace({'gender': {'M': 'Male', 'F': 'Female'}})
+        .groupby('gender')['patient_id']
+        .nunique()
+        .reset_index(name='Number of Patients')
+        .rename(columns={'gender': 'Gender'})
+    )
+    fig = pxpress.pie(
         pt_by_gender,
         names='Gender',
         values='Number of Patients',
@@ -139,11 +114,17 @@ with col11:
         color_discrete_map={'Male': 'lightblue', 'Female': 'lightpink'},
         hole=0.5
     )
-    st.plotly_chart(gender_chart, use_container_width=True)
+    return fig
 
-# age chart
-with col12:
-    age_chart = pxpress.bar(
+
+def age_chart():
+    pt_by_age_group = (
+        admissions.groupby("age_group", observed=True)["patient_id"]
+        .nunique()
+        .reset_index(name="Number of Patients")
+        .rename(columns={"age_group": "Age Group"})
+    )
+    fig = pxpress.bar(
         pt_by_age_group,
         x="Age Group", 
         y="Number of Patients",
@@ -152,13 +133,20 @@ with col12:
         color="Age Group",
         color_discrete_sequence=pxpress.colors.qualitative.Pastel
     )
-    age_chart.update_layout(yaxis_title="Number of Patients", xaxis_title="Age Group (Years)", showlegend=False)
-    age_chart.update_traces(width=1)
-    st.plotly_chart(age_chart, use_container_width=True)
-
-#race chart
-with col13:
-    race_chart = pxpress.pie(
+    fig.update_layout(yaxis_title="Number of Patients", xaxis_title="Age Group (Years)", showlegend=False)
+    fig.update_traces(width=1)
+    return fig
+
+
+#races are grouped into a few categories once, when the dataset is loaded
+def race_chart():
+    pt_by_race = (
+        admissions.groupby('race_grouped', observed=True)['patient_id']
+        .nunique()
+        .reset_index(name='Number of Patients')
+        .rename(columns={'race_grouped': 'Race'})
+    )
+    fig = pxpress.pie(
         pt_by_race,
         names='Race',
         values='Number of Patients',
@@ -167,4 +155,23 @@ with col13:
         color_discrete_sequence=pxpress.colors.qualitative.Pastel,
         hole=0.3
     )
-    st.plotly_chart(race_chart, use_container_width=True)
+    return fig
+
+
+#visualise patient demographics
+st.subheader("Patient Demographics")
+
+# Create 2 columns for charts
+col11, col12, col13= st.columns(3)
+
+# gender pie chart
+with col11:
+    st.plotly_chart(chart('gender', gender_chart), use_container_width=True)
+
+# age chart
+with col12:
+    st.plotly_chart(chart('age', age_chart), use_container_width=True)
+
+#race chart
+with col13:
+    st.plotly_chart(chart('race', race_chart), use_container_width=True)
@@ -0,0 +1,138 @@
+"""Figures of the patient chart page, shared with the patient list's prefetch.
+
+``patient_figures`` builds one patient's vitals or labs charts for a view of
+the chart (the latest readings, or the full history of a window) through
+the shared figure cache, under the same key whether it is called by the
+page or by a background prefetch, so a warmed chart opens as a cache hit.
+"""
+from functools import partial
+
+import pandas as pd
+import plotly.graph_objects as go
+
+from dataset import QUERY_TTL_SECONDS, history, latest_patient_rows, patient_rows
+from downsample import downsample
+from figure_cache import get_figure_cache
+from rollups import ROLLUP_LEVELS
+
+
+ordered_vitals = ["SBP", "Heart Rate", "DBP", "SpO2"]
+vital_colors = {
+    "SBP": "red",
+    "DBP": "red",
+    "SpO2": "blue",
+    "Heart Rate": "green"
+}
+# Color mapping for labs (high-contrast for grey/white background)
+lab_colors = {
+    "Creatinine": "#0044cc",     # vivid blue
+    "Hemoglobin": "#cc0000",     # deep red
+    "Magnesium": "#7e00cc",      # dark purple
+    "NT-proBNP": "#ff6600",      # bright orange
+    "Potassium": "#007a29",      # deep green
+    "Sodium": "#008080",         # dark teal
+    "Troponin T": "#ffcc00",     # golden yellow
+    "eGFR": "#5c4033"            # dark brown
+}
+
+level_names = {'5min': '5-minute', '1h': 'hourly', '1d': 'daily'}
+
+
+def trace(df, time_col, value_col, name, color, full_history):
+    if not full_history:
+        return go.Scatter(
+            x=df[time_col],
+            y=df[value_col],
+            mode='lines+markers',
+            name=name,
+            line=dict(color=color),
+            marker=dict(color=color, size=10)
+        )
+    # long series keep their shape with a fraction of the points, WebGL draws them
+    df = downsample(df, time_col, value_col)
+    return go.Scattergl(
+        x=df[time_col],
+        y=df[value_col],
+        mode='lines+markers',
+        name=name,
+        line=dict(color=color),
+        marker=dict(color=color, size=4)
+    )
+
+
+def rollup_traces(df, level, name, color):
+    # min-max band and mean line of the buckets, at the middle of each bucket
+    df = downsample(df.assign(mean=df['sum'] / df['count']), 'time', 'mean')
+    times = df['time'] + ROLLUP_LEVELS[level] / 2
+    band = dict(mode='lines', line=dict(width=0, color=color), opacity=0.3, showlegend=False, hoverinfo='skip')
+    return [
+        go.Scattergl(x=times, y=df['max'], **band),
+        go.Scattergl(x=times, y=df['min'], fill='tonexty', **band),
+        go.Scattergl(
+            x=times,
+            y=df['mean'],
+            mode='lines+markers',
+            name=name,
+            line=dict(color=color),
+            marker=dict(color=color, size=4)
+        ),
+    ]
+
+
+def figure(df, level, time_col, value_col, name, color, full_history):
+    fig = go.Figure()
+    if level is None:
+        fig.add_trace(trace(df, time_col, value_col, name, color, full_history))
+        title = f"{name} Over Time"
+    else:
+        fig.add_traces(rollup_traces(df, level, name, color))
+        title = f"{name} Over Time ({level_names[level]} min / mean / max)"
+    fig.update_layout(title=title, xaxis_title="Time", yaxis_title="Result")
+    return fig
+
+
+def vital_figures(vitals_df, level, full_history):
+    name_col = "vital_name" if level is None else "measure"
+    figs = []
+    for vital_name in ordered_vitals:
+        df = vitals_df[vitals_df[name_col] == vital_name]
+        figs.append(figure(df, level, "vital_time", "vital_reading", vital_name, vital_colors.get(vital_name, 'gray'), full_history))
+    return figs
+
+
+def lab_figures(labs_df, level, full_history):
+    name_col = "lab_type_name" if level is None else "measure"
+    figs = []
+    for lab_type_name in labs_df[name_col].unique():
+        df = labs_df[labs_df[name_col] == lab_type_name]
+        figs.append(figure(df, level, "lab_time", "lab_value", lab_type_name, lab_colors.get(lab_type_name, 'gray'), full_history))
+    return figs
+
+
+FIGURES = {'vitals': vital_figures, 'labs': lab_figures}
+
+
+def view_rows(name, pid, full_history, window):
+    """(level, rows) of one patient's vitals or labs for one view of the chart, queried for that patient only"""
+    if not full_history:
+        return None, latest_patient_rows(name, pid)
+    if window is None:
+        return None, patient_rows(name, pid)
+    # raw rows when few enough fall in the window, otherwise rolled up by the warehouse
+    return history(name, pid, pd.Timestamp(window[0]), pd.Timestamp(window[1]))
+
+
+def patient_figures(name, pid, full_history=False, window=None):
+    """One patient's vitals or labs charts, built once per view for as long as its query results are cached"""
+    def build():
+        level, rows = view_rows(name, pid, full_history, window)
+        return FIGURES[name](rows, level, full_history)
+
+    # a hit neither looks up the query results nor touches the rows
+    view = (pid, full_history, window)
+    return get_figure_cache().figures(('patientchart', name, view), build, ttl=QUERY_TTL_SECONDS)
+
+
+def prefetch_steps(pid):
+    """Steps that warm the charts the page opens with, for ``prefetch``"""
+    return [partial(patient_figures, name, pid) for name in FIGURES]
@@ -0,0 +1,114 @@
+"""Server-side paging for the patient list page.
+
+``PatientList`` builds each hospital's deduplicated patient table, with an
+id search index, a reason-for-admission text index and a sort permutation
+per column over it, once per dataset. Filtering and sorting return row
+positions into that table, and only the rows of the visible page are turned
+into a frame and sent to the browser.
+"""
+import numpy as np
+import streamlit as st
+
+from search_index import IdIndex, TextIndex
+
+
+# admissions column -> patient list column
+DISPLAY_COLUMNS = {
+    'patient_id': 'patient_id',
+    'age': 'age',
+    'gender': 'gender',
+    'diagnosis_description': 'Reason for Admission',
+    'length_of_stay': 'length_of_stay',
+    'lace_score': 'LACE Score',
+    'cci_score': 'CCI Score',
+}
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+class PatientList:
+    """Each hospital's patient table, with filtering, sorting and paging by row position"""
+
+    def __init__(self, admissions):
+        table = admissions[['Hospital', *DISPLAY_COLUMNS]].rename(columns=DISPLAY_COLUMNS)
+        self.tables = {
+            hospital: part.drop(columns='Hospital').drop_duplicates(ignore_index=True)
+            for hospital, part in table.groupby('Hospital', sort=True, observed=True)
+        }
+        self.id_indexes = {hospital: IdIndex(table['patient_id']) for hospital, table in self.tables.items()}
+        self.text_indexes = {
+            hospital: TextIndex(table['Reason for Admission']) for hospital, table in self.tables.items()
+        }
+        self.sort_orders = {
+            hospital: {column: sort_order(table[column]) for column in table}
+            for hospital, table in self.tables.items()
+        }
+
+    @property
+    def nbytes(self):
+        tables = sum(table.memory_usage(deep=True).sum() for table in self.tables.values())
+        indexes = [*self.id_indexes.values(), *self.text_indexes.values()]
+        orders = sum(order.nbytes for orders in self.sort_orders.values() for order, _ in orders.values())
+        return int(tables + sum(index.nbytes for index in indexes) + orders)
+
+    def hospitals(self):
+        """Sorted hospital names (appended hospitals come last in the category order)"""
+        return sorted(self.tables)
+
+    def search(self, hospital, query='', text=''):
+        """Positions of the hospital's rows whose patient_id contains ``query``
+
+        With ``text``, only rows whose reason for admission contains every
+        word of it are kept, best match first.
+        """
+        rows = self.id_indexes[hospital].contains(query)
+        ranked = self.text_indexes[hospital].search(text)
+        if ranked is None:
+            return rows
+        return ranked if not query else ranked[np.isin(ranked, rows)]
+
+    def sort(self, hospital, rows, column, ascending=True):
+        """``rows`` reordered by one column, missing values last
+
+        Reads the column's precomputed permutation (backwards when
+        descending) and keeps the positions that are in ``rows``.
+        """
+        order, n_valid = self.sort_orders[hospital][column]
+        keep = np.zeros(len(self.tables[hospital]), bool)
+        keep[rows] = True
+        valid, missing = order[:n_valid], order[n_valid:]
+        if not ascending:
+            valid = valid[::-1]
+        return np.concatenate([valid[keep[valid]], missing[keep[missing]]])
+
+    def page(self, hospital, rows, start, stop):
+        """The rows[start:stop] of the hospital's table as a frame"""
+        return self.tables[hospital].iloc[rows[start:stop]]
+
+
+def sort_order(values):
+    """Row positions that sort a column, and how many of them are not missing"""
+    order = values.reset_index(drop=True).sort_values(kind='stable', na_position='last').index
+    return order.to_numpy(np.int32), int(values.notna().sum())
+
+
+def show_pager(n_rows, filters):
+    """Rows per page / page number controls, returns the [start, stop) of the visible page
+
+    The page goes back to 1 whenever ``filters`` differ from the last rerun.
+    """
+    col1, col2 = st.columns(2)
+    page_size = col1.selectbox("Rows per page", PAGE_SIZES, key="patient_list_page_size")
+    n_pages = max(1, -(-n_rows // page_size))
+
+    filters = (*filters, page_size)
+    if st.session_state.get("patient_list_filters") != filters:
+        st.session_state.patient_list_filters = filters
+        st.session_state.patient_list_page = 1
+    st.session_state.patient_list_page = min(st.session_state.get("patient_list_page", 1), n_pages)
+    page = col2.number_input(f"Page (of {n_pages:,})", min_value=1, max_value=n_pages, key="patient_list_page")
+
+    start = (page - 1) * page_size
+    stop = min(start + page_size, n_rows)
+    st.caption(f"Showing {start + 1 if n_rows else 0:,}–{stop:,} of {n_rows:,}")
+    return start, stop
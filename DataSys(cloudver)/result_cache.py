@@ -0,0 +1,129 @@
+"""Persistent cache of query results shared by every server process.
+
+Results are stored as zstd-compressed Arrow IPC files under one directory,
+keyed by a hash of the backend, the normalized SQL text and the query
+parameters. A small SQLite index next to them records sizes and times for
+the TTL and the least-recently-used byte budget, and keeps hit / miss /
+bytes-saved counters. SQLite serializes the index updates between
+processes and result files are written to a temporary name and renamed, so
+readers never see a partial file.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import pyarrow as pa
+
+
+CACHE_DIR = os.environ.get('HEARTTRACK_CACHE_DIR', os.path.join('.cache', 'query_results'))
+CACHE_TTL = int(os.environ.get('HEARTTRACK_CACHE_TTL', 3600))
+CACHE_MAX_BYTES = int(os.environ.get('HEARTTRACK_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+STATS = ['hits', 'misses', 'bytes_saved']
+
+# quoted literals are kept as they are, whitespace anywhere else is collapsed
+SQL_TOKENS = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)|\s+")
+
+
+def normalize_sql(sql):
+    return SQL_TOKENS.sub(lambda m: m.group(1) or ' ', sql).strip()
+
+
+class ResultCache:
+    """Arrow tables on disk with a TTL and a total size budget"""
+
+    def __init__(self, root=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, nbytes INTEGER, created REAL, used REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def connect(self):
+        # a connection per call, so threads and processes never share one
+        return sqlite3.connect(os.path.join(self.root, 'index.sqlite'), timeout=30)
+
+    def path(self, key):
+        return os.path.join(self.root, f'{key}.arrow')
+
+    def key(self, backend, sql, params=None):
+        text = json.dumps([backend, normalize_sql(sql), params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key):
+        """The cached table, or None if it is missing or older than the TTL"""
+        now = time.time()
+        with self.connect() as db:
+            row = db.execute('SELECT nbytes, created FROM entries WHERE key = ?', (key,)).fetchone()
+            table = None
+            if row is not None and now - row[1] <= self.ttl:
+                try:
+                    with pa.memory_map(self.path(key), 'r') as source:
+                        table = pa.ipc.open_file(source).read_all()
+                except (FileNotFoundError, pa.ArrowInvalid):
+                    table = None
+            if table is None:
+                self.count(db, misses=1)
+                return None
+            db.execute('UPDATE entries SET used = ? WHERE key = ?', (now, key))
+            self.count(db, hits=1, bytes_saved=row[0])
+            return table
+
+    def put(self, key, table):
+        """Store a result, then evict expired and least recently used entries"""
+        path = self.path(key)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+
+        now = time.time()
+        with self.connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (key, table.nbytes, now, now),
+            )
+            self.evict(db, now)
+
+    def evict(self, db, now):
+        expired = db.execute('SELECT key FROM entries WHERE created < ?', (now - self.ttl,)).fetchall()
+        over_budget = []
+        total = db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries WHERE created >= ?', (now - self.ttl,)).fetchone()[0]
+        if total > self.max_bytes:
+            for key, nbytes in db.execute(
+                'SELECT key, nbytes FROM entries WHERE created >= ? ORDER BY used', (now - self.ttl,)
+            ):
+                if total <= self.max_bytes:
+                    break
+                over_budget.append((key,))
+                total -= nbytes
+        for (key,) in expired + over_budget:
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def count(self, db, **increments):
+        db.executemany(
+            'INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            increments.items(),
+        )
+
+    def stats(self):
+        """Hit / miss / bytes-saved counters plus the current entries and bytes"""
+        with self.connect() as db:
+            stats = dict.fromkeys(STATS, 0)
+            stats.update(db.execute('SELECT name, value FROM stats').fetchall())
+            stats['entries'], stats['bytes'] = db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries'
+            ).fetchone()
+        return stats
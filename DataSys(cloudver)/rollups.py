@@ -0,0 +1,79 @@
+"""Multi-resolution rollups of the vitals and labs tables for zoomable charts.
+
+Every level buckets each patient's readings by measurement and a fixed
+time width and keeps min / max / sum / count per bucket (the mean is
+sum / count), so buckets rolled up from different batches of rows combine
+exactly when new rows arrive. Buckets start at multiples of their width
+since the epoch, the same boundaries the cloud queries use. A chart over any
+window reads the finest level with no more buckets than it has points to
+draw, or the raw rows when there are few enough of them, so it reads a few
+hundred rows however long the stay is. Every level is kept for every
+patient: a level that barely shrinks a sparse patient's rows can still be
+the one that keeps a dense patient's window within the budget.
+"""
+import pandas as pd
+
+from downsample import PIXEL_BUDGET
+
+
+# level -> bucket width, finest first
+ROLLUP_LEVELS = {
+    '5min': pd.Timedelta(minutes=5),
+    '1h': pd.Timedelta(hours=1),
+    '1d': pd.Timedelta(days=1),
+}
+# always kept, it also gives each patient's time span and readings per day
+DAILY = '1d'
+
+# time column -> (measurement name column, value column) of the fact tables
+MEASURES = {
+    'vital_time': ('vital_name', 'vital_reading'),
+    'lab_time': ('lab_type_name', 'lab_value'),
+}
+
+KEY_COLUMNS = ['patient_id', 'measure', 'time']
+
+
+def rollup(df, time_col, width):
+    """min / max / sum / count of every (patient, measurement, time bucket)"""
+    name_col, value_col = MEASURES[time_col]
+    df = df.dropna(subset=[time_col, value_col])
+    keys = [df['patient_id'], df[name_col].rename('measure'), df[time_col].dt.floor(width).rename('time')]
+    values = df[value_col].astype('float64')
+    return values.groupby(keys, observed=True, sort=True).agg(['min', 'max', 'sum', 'count']).reset_index()
+
+
+def combine(rollups):
+    """One row per bucket of rollups that may repeat buckets"""
+    rollups = pd.concat(rollups, ignore_index=True)
+    return rollups.groupby(KEY_COLUMNS, observed=True, sort=True).agg(
+        min=('min', 'min'), max=('max', 'max'), sum=('sum', 'sum'), count=('count', 'sum'),
+    ).reset_index()
+
+
+def window_count(daily, start, end):
+    """Upper bound of the raw readings in [start, end), from the daily rollup"""
+    overlaps = (daily['time'] + ROLLUP_LEVELS[DAILY] > start) & (daily['time'] < end)
+    return int(daily.loc[overlaps, 'count'].sum())
+
+
+def span(daily):
+    """[first, last) day covered by a daily rollup, None if it is empty"""
+    if daily.empty:
+        return None
+    return daily['time'].min(), daily['time'].max() + ROLLUP_LEVELS[DAILY]
+
+
+def choose_level(start, end, raw_count, levels=ROLLUP_LEVELS, n_points=PIXEL_BUDGET):
+    """Rollup level to draw [start, end) with, None for the raw rows
+
+    The finest of ``levels`` with at most ``n_points`` buckets in the
+    window, so a level missing from ``levels`` falls back to the next
+    coarser one, never to the raw rows: they are too many to draw.
+    """
+    if raw_count <= n_points:
+        return None
+    for level, width in ROLLUP_LEVELS.items():
+        if level in levels and (end - start) / width <= n_points:
+            return level
+    return DAILY
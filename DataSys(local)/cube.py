@@ -0,0 +1,93 @@
+"""Precomputed aggregates for the overview and by-hospital dashboards.
+
+The cube is built once from the admissions table (with the derived
+age_group and race_grouped columns) and holds, for every
+hospital (plus all hospitals together), the exact distinct patient and
+admission counts of each value of each breakdown dimension, and the KPI
+means. Pages render from it in O(number of groups) instead of O(rows).
+"""
+import numpy as np
+import pandas as pd
+
+
+ALL_HOSPITALS = '(All hospitals)'
+
+# breakdowns shown on the dashboards
+DIMENSIONS = [
+    'Hospital',
+    'admission_location',
+    'admission_type',
+    'discharge_location',
+    'gender',
+    'age_group',
+    'race_grouped',
+]
+
+# breakdowns drawn with every category, empty ones as zero bars, like the
+# pd.cut age bands always were (the other dimensions list only what occurs)
+ALL_CATEGORIES = ['age_group']
+
+KPI_COLUMNS = ['age', 'length_of_stay', 'lace_score', 'cci_score']
+
+def distinct_counts(df, by, observed=True):
+    counts = (
+        df.groupby(by, observed=observed)
+        .agg(patients=('patient_id', 'nunique'), admissions=('admission_id', 'nunique'))
+        .reset_index()
+    )
+    # values keep their category order (e.g. age bands) but are stored as plain objects
+    return counts.astype({'value': object})
+
+
+class AdmissionsCube:
+    """Distinct counts per hospital x dimension x value, plus KPI means"""
+
+    def __init__(self, admissions):
+        # grouping keys: every admission under ALL_HOSPITALS, and under its own hospital
+        levels = [
+            pd.Series(ALL_HOSPITALS, index=admissions.index, name='Hospital'),
+            admissions['Hospital'].astype(object),
+        ]
+
+        parts = []
+        for dim in DIMENSIONS:
+            for level in levels[:1] if dim == 'Hospital' else levels:
+                part = distinct_counts(admissions, [level, admissions[dim].rename('value')],
+                                       observed=dim not in ALL_CATEGORIES)
+                parts.append(part.assign(dimension=dim))
+        self.counts = (
+            pd.concat(parts, ignore_index=True)
+            .set_index(['Hospital', 'dimension'])
+            .sort_index(kind='stable')
+        )
+
+        kpi_aggs = dict(
+            patients=('patient_id', 'nunique'),
+            admissions=('admission_id', 'nunique'),
+            **{col: (col, 'mean') for col in KPI_COLUMNS},
+        )
+        # the KPI columns may be stored narrowed (float32), their means are taken in float64 like DistinctCounts
+        values = admissions.assign(**{col: admissions[col].astype('float64') for col in KPI_COLUMNS})
+        self.kpi_table = pd.concat([values.groupby(level).agg(**kpi_aggs) for level in levels])
+
+    @property
+    def nbytes(self):
+        return int(self.counts.memory_usage(deep=True).sum() + self.kpi_table.memory_usage(deep=True).sum())
+
+    def hospitals(self):
+        """Sorted hospital names"""
+        return sorted(h for h in self.kpi_table.index if h != ALL_HOSPITALS)
+
+    def kpis(self, hospital=ALL_HOSPITALS):
+        """Patient/admission totals and KPI means for one hospital"""
+        if hospital not in self.kpi_table.index:
+            return pd.Series({'patients': 0, 'admissions': 0, **{col: np.nan for col in KPI_COLUMNS}})
+        return self.kpi_table.loc[hospital]
+
+    def breakdown(self, dimension, count, name, hospital=ALL_HOSPITALS):
+        """Distinct ``count`` ('patients' or 'admissions') per value of a dimension"""
+        if (hospital, dimension) not in self.counts.index:
+            # e.g. a hospital whose admissions have no value for the dimension yet
+            return pd.DataFrame({dimension: pd.Series(dtype=object), name: pd.Series(dtype='int64')})
+        rows = self.counts.loc[(hospital, dimension)]
+        return pd.DataFrame({dimension: rows['value'].to_numpy(), name: rows[count].to_numpy()})
@@ -0,0 +1,445 @@
+"""Process-wide dataset shared by every browser session.
+
+``load_dataset`` is cached with ``st.cache_resource`` so the fact tables are
+held once per server process instead of once per session. Pages must treat
+the shared frames as read-only and keep only small filters in
+``st.session_state``. The only writer is the incremental ingest path, which
+reads the rows appended to the CSVs past the bytes already held and swaps
+in the updated indexes and aggregates.
+"""
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from bitmaps import DistinctCounts
+from concurrent_load import load_all
+from cube import AdmissionsCube
+from derived import add_derived_columns
+from figure_cache import get_figure_cache
+from latest import LatestRows, latest
+from loader import (
+    compact, concat_tables, csv_mark, csv_size, has_parquet, load_table, open_store, read_csv_chunks,
+)
+from patient_index import PatientRows, sort_by_patient
+from patient_list import PatientList
+from patient_store import PatientRollups, PatientStore, add_segment, save_segments
+from rollups import DAILY, MEASURES, ROLLUP_LEVELS, choose_level, combine, span, window_count
+
+
+# dataset key -> (table name, time column of the per-patient tables)
+TABLES = {
+    'admissions': ('fact_admissions', None),
+    'vitals': ('fact_vitals', 'vital_time'),
+    'labs': ('fact_lab_results', 'lab_time'),
+}
+
+# how often pages check the CSVs for appended rows
+REFRESH_SECONDS = 30
+
+# fold the appended tail into an in-memory base once it reaches this fraction of it
+MERGE_FRACTION = 0.1
+# write the appended tail of a store as a new segment once it has this many rows
+FOLD_ROWS = 200_000
+
+
+class TablePart:
+    """Rows of a vitals or labs table with their own rollups and latest rows
+
+    In memory (``PatientRows``) or memory-mapped (a ``PatientStore`` or one
+    of its segments). ``appended`` marks the in-memory tail of rows appended
+    since the table was loaded or last folded.
+    """
+
+    def __init__(self, rows, rollups, latest, max_time, appended=False):
+        self.rows = rows
+        self.rollups = rollups
+        self.latest = latest
+        self.max_time = max_time
+        self.appended = appended
+
+    @classmethod
+    def build(cls, df, time_col, levels=None, appended=False):
+        rows = PatientRows(df, time_col)
+        rollups = PatientRollups.build(rows.frame, time_col, levels)
+        return cls(rows, rollups, LatestRows(rows.frame, time_col), rows.max(time_col), appended)
+
+    @classmethod
+    def open(cls, store):
+        return cls(store, store.rollups(), store.latest(), store.max_time)
+
+    def __contains__(self, pid):
+        return pid in self.rows
+
+
+class PatientTable:
+    """Per-patient access to vitals or labs, as a few parts merged per patient
+
+    The first part is the base: an in-memory ``PatientRows`` or a
+    memory-mapped ``PatientStore`` built with ``python loader.py``, followed
+    by the store's segments. Rows appended since go into an in-memory tail,
+    which is folded into a new segment of the store once it has
+    ``FOLD_ROWS`` rows, or taken into an in-memory base once it reaches
+    ``MERGE_FRACTION`` of it. Appended rows can be older than rows already
+    held (a late reading, or a tie with the latest time), so a patient's
+    rows from several parts are sorted by time again, and their buckets and
+    latest rows merged.
+
+    ``parts`` is replaced as a whole, so readers never see a half-done swap.
+    """
+
+    def __init__(self, base, time_col):
+        self.time_col = time_col
+        if isinstance(base, PatientStore):
+            self.store = base
+            self.parts = tuple(TablePart.open(store) for store in [base, *base.segments()])
+        else:
+            self.store = None
+            self.parts = (TablePart.build(base, time_col),)
+        self.max_time = latest_time(part.max_time for part in self.parts)
+
+    @property
+    def tail(self):
+        return self.parts[-1] if self.parts[-1].appended else None
+
+    @property
+    def levels(self):
+        """Rollup levels of the table, those kept for its base"""
+        return self.parts[0].rollups.levels
+
+    def holding(self, pid):
+        """The parts with rows of a patient, the base if there are none"""
+        return [part for part in self.parts if pid in part] or self.parts[:1]
+
+    def rows(self, pid):
+        parts = self.holding(pid)
+        if len(parts) == 1:
+            return parts[0].rows.rows(pid)
+        return sort_by_patient(concat_tables([part.rows.rows(pid) for part in parts]), self.time_col)
+
+    def latest_rows(self, pid):
+        """One patient's latest rows per measurement, newest first"""
+        parts = self.holding(pid)
+        if len(parts) == 1:
+            return parts[0].latest.rows(pid)
+        return latest(concat_tables([part.latest.rows(pid) for part in parts]), self.time_col)
+
+    def rollup_rows(self, pid, level):
+        """One patient's buckets at one rollup level"""
+        parts = self.holding(pid)
+        if len(parts) == 1:
+            return parts[0].rollups.rows(pid, level)
+        return combine([part.rollups.rows(pid, level) for part in parts])
+
+    def append(self, df, replaced=False):
+        """Add rows read from the CSV, returns how many were kept
+
+        Rows read past the offset of the previous read are all new, whatever
+        their time. A CSV that was replaced is read again from the top, and
+        then only the rows not held yet are kept.
+        """
+        if replaced:
+            df = self.unseen(df)
+        if df.empty:
+            return 0
+
+        tail = self.tail
+        held = self.parts[:-1] if tail else self.parts
+        rows = concat_tables([tail.rows.frame if tail else None, df])
+        if self.store is None and len(rows) >= MERGE_FRACTION * len(held[0].rows):
+            self.parts = (TablePart.build(concat_tables([held[0].rows.frame, rows]), self.time_col),)
+        else:
+            self.parts = (*held, TablePart.build(rows, self.time_col, list(self.levels), appended=True))
+        self.max_time = latest_time([self.max_time, df[self.time_col].max()])
+        return len(df)
+
+    def unseen(self, df):
+        """Rows of a re-read CSV that are not held yet
+
+        Rows later than everything held are new. The others are compared with
+        their patient's rows on (patient, measurement, time, value).
+        """
+        if self.max_time is None:
+            return df
+        name_col, value_col = MEASURES[self.time_col]
+        key = ['patient_id', name_col, self.time_col, value_col]
+        df = df.reset_index(drop=True)
+        keep = (df[self.time_col] > self.max_time).to_numpy(copy=True)
+        for pid, rows in df[~keep].groupby('patient_id', sort=False):
+            held = pd.MultiIndex.from_frame(self.rows(pid)[key])
+            keep[rows.index] = ~pd.MultiIndex.from_frame(rows[key]).isin(held)
+        return df[keep]
+
+    def fold_due(self):
+        tail = self.tail
+        return self.store is not None and tail is not None and len(tail.rows) >= FOLD_ROWS
+
+    def fold(self, mark):
+        """Write the tail into a new segment of the store, ``mark`` is the CSV mark of the rows it now holds"""
+        root = self.store.root
+        opened = {part.rows.root: part for part in self.parts[1:] if not part.appended}
+        segments = add_segment(root, [part.rows for part in opened.values()], self.tail.rows.frame,
+                               self.time_col, list(self.levels))
+        save_segments(root, segments, **mark)
+        parts = [opened.get(segment.root) or TablePart.open(segment) for segment in segments]
+        self.parts = (self.parts[0], *parts)
+
+    def in_memory(self):
+        """The in-memory parts of this table (a store and its segments are memory-mapped)"""
+        return [part for part in self.parts if isinstance(part.rows, PatientRows)]
+
+    def frames(self):
+        return [part.rows.frame for part in self.in_memory()]
+
+    @property
+    def nbytes(self):
+        return sum(object_bytes(part.rows.frame) + part.rows.index.nbytes for part in self.in_memory())
+
+    @property
+    def latest_nbytes(self):
+        return sum(part.latest.nbytes for part in self.parts if isinstance(part.latest, LatestRows))
+
+    @property
+    def rollup_nbytes(self):
+        return sum(part.rollups.nbytes for part in self.parts)
+
+
+def latest_time(times):
+    """Latest of some times, None if there are none"""
+    times = [pd.Timestamp(t) for t in times if t is not None and pd.notna(t)]
+    return max(times) if times else None
+
+
+class Dataset:
+    """Fact tables shared across sessions
+
+    Vitals and labs come either from in-memory frames or, when they have
+    been built with ``python loader.py``, from memory-mapped patient stores
+    that are never loaded whole.
+    """
+
+    def __init__(self, admissions, patient_tables, memory_report=None, csv_offsets=None, load_seconds=None):
+        self.lock = threading.RLock()
+        self.version = 0
+        self.memory_report = memory_report
+        self.load_seconds = load_seconds or {}
+        self.patient_tables = patient_tables
+        self.csv_offsets = csv_offsets or {}
+        self.checked_at = time.monotonic()
+        self.set_admissions(admissions)
+
+    def set_admissions(self, admissions):
+        """Rebuild the admissions aggregates and swap them in together"""
+        cube = AdmissionsCube(admissions)
+        distinct = DistinctCounts(admissions)
+        patient_list = PatientList(admissions)
+        self.admissions, self.cube, self.distinct, self.patient_list = admissions, cube, distinct, patient_list
+        self.measure()
+
+    def measure(self):
+        self.nbytes = {'admissions': object_bytes(self.admissions)}
+        for name, table in self.patient_tables.items():
+            self.nbytes[name] = table.nbytes
+            self.nbytes[f'{name} rollups'] = table.rollup_nbytes
+            self.nbytes[f'{name} latest'] = table.latest_nbytes
+        self.nbytes['aggregate cube'] = self.cube.nbytes
+        self.nbytes['distinct bitmaps'] = self.distinct.nbytes
+        self.nbytes['patient list'] = self.patient_list.nbytes
+
+    def tables(self):
+        """Every in-memory frame the dataset holds"""
+        frames = {'admissions': self.admissions}
+        for name, table in self.patient_tables.items():
+            for i, frame in enumerate(table.frames()):
+                frames[f'{name}[{i}]'] = frame
+        return frames
+
+    def patient_rows(self, name, pid):
+        """One patient's rows of the vitals or labs table"""
+        return self.patient_tables[name].rows(pid)
+
+    def latest_rows(self, name, pid):
+        """One patient's latest vitals or labs per measurement, newest first"""
+        return self.patient_tables[name].latest_rows(pid)
+
+    def time_span(self, pid):
+        """[first, last) day with any of the patient's vitals or labs, None if there are none"""
+        spans = [span(table.rollup_rows(pid, DAILY)) for table in self.patient_tables.values()]
+        spans = [s for s in spans if s is not None]
+        if not spans:
+            return None
+        return min(start for start, _ in spans), max(end for _, end in spans)
+
+    def history(self, name, pid, start, end):
+        """(level, rows) charting one patient's vitals or labs over [start, end)
+
+        The raw rows (level None) when few enough fall in the window,
+        otherwise the buckets of the rollup level that fits it.
+        """
+        table = self.patient_tables[name]
+        daily = table.rollup_rows(pid, DAILY)
+        level = choose_level(start, end, window_count(daily, start, end), table.levels)
+        if level is None:
+            rows = table.rows(pid)
+            times = rows[table.time_col]
+            return None, rows[(times >= start) & (times < end)]
+        rows = table.rollup_rows(pid, level)
+        return level, rows[(rows['time'] + ROLLUP_LEVELS[level] > start) & (rows['time'] < end)]
+
+    def append(self, admissions=None, vitals=None, labs=None, replaced=False):
+        """Add rows read from the table CSVs
+
+        Rows read past the bytes already held are all new. With ``replaced``
+        (a CSV read again from the top) admissions keep only new
+        admission_ids and vitals / labs only rows not held yet. Returns the
+        number of rows added per table.
+        """
+        added = {}
+        with self.lock:
+            if admissions is not None:
+                if replaced:
+                    admissions = admissions[~admissions['admission_id'].isin(self.admissions['admission_id'])]
+                if len(admissions):
+                    admissions = add_derived_columns(compact(admissions, 'fact_admissions')[0])
+                    self.set_admissions(concat_tables([self.admissions, admissions]))
+                added['admissions'] = len(admissions)
+            for name, rows in [('vitals', vitals), ('labs', labs)]:
+                if rows is not None:
+                    added[name] = self.patient_tables[name].append(rows, replaced)
+            if any(added.values()):
+                self.version += 1
+                self.measure()
+        return added
+
+    def refresh(self):
+        """Ingest the rows appended to the table CSVs since the last check
+
+        The CSVs are read in chunks from the byte each one was read up to, and
+        a store's tail is folded into a segment as soon as it is large enough.
+        """
+        added = {}
+        with self.lock:
+            self.checked_at = time.monotonic()
+            for key, (name, _) in TABLES.items():
+                offset, size = self.csv_offsets.get(name), csv_size(name)
+                # no CSV at load, removed since, or nothing new
+                if offset is None or size is None or size == offset:
+                    continue
+                # a CSV smaller than what was read has been replaced, it is read again from the top
+                replaced = size < offset
+                for rows, self.csv_offsets[name] in read_csv_chunks(name, 0 if replaced else offset):
+                    added[key] = added.get(key, 0) + self.append(replaced=replaced, **{key: rows})[key]
+                    table = self.patient_tables.get(key)
+                    if table is not None and table.fold_due():
+                        table.fold(csv_mark(name, self.csv_offsets[name]))
+        return added
+
+    def refresh_if_due(self):
+        if time.monotonic() - self.checked_at >= REFRESH_SECONDS:
+            self.refresh()
+
+
+def open_dataset():
+    """Load the fact tables and ingest the CSV rows they do not hold yet
+
+    Admissions and the vitals / labs without a patient store are read
+    concurrently, in worker processes when any of them is parsed from CSV.
+    Each table holds a known number of bytes of its CSV (a store or Parquet
+    copy records it, a parse stops at the last complete line), and only
+    the rows past them are read afterwards.
+    """
+    stores = {key: open_store(TABLES[key][0]) for key in ['vitals', 'labs']}
+    loads = {'admissions': (load_table, 'fact_admissions')}
+    loads.update({key: (load_table, TABLES[key][0]) for key, store in stores.items() if store is None})
+    parse_csv = any(not has_parquet(TABLES[key][0]) for key in loads)
+    tables, load_seconds = load_all(loads, processes=parse_csv)
+
+    admissions, admissions_bytes, memory_report = tables['admissions']
+    csv_offsets = {'fact_admissions': admissions_bytes}
+    patient_tables = {}
+    for key, store in stores.items():
+        name, time_col = TABLES[key]
+        if store is None:
+            df, csv_offsets[name], _ = tables[key]
+            patient_tables[key] = PatientTable(df, time_col)
+        else:
+            csv_offsets[name] = store.manifest['csv_bytes']
+            patient_tables[key] = PatientTable(store, time_col)
+    # tables without a CSV are never refreshed
+    csv_offsets = {name: offset for name, offset in csv_offsets.items() if csv_size(name) is not None}
+    dataset = Dataset(admissions, patient_tables, memory_report, csv_offsets, load_seconds)
+    dataset.refresh()
+    return dataset
+
+
+@st.cache_resource
+def load_dataset():
+    """The fact tables, loaded once for the whole process"""
+    return open_dataset()
+
+
+def get_dataset():
+    """The shared dataset, topped up with rows appended since the last check"""
+    dataset = load_dataset()
+    dataset.refresh_if_due()
+    return dataset
+
+
+def object_bytes(obj):
+    """Approximate bytes held by a session_state value"""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    return sys.getsizeof(obj)
+
+
+def session_bytes():
+    """Bytes this session holds on top of the shared dataset"""
+    shared = {id(obj) for obj in get_dataset().tables().values()}
+    return sum(
+        object_bytes(value)
+        for value in st.session_state.to_dict().values()
+        if id(value) not in shared
+    )
+
+
+def format_bytes(n):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if n < 1024 or unit == 'GB':
+            return f'{n:,.0f} {unit}' if unit == 'B' else f'{n:,.1f} {unit}'
+        n /= 1024
+
+
+def show_memory_gauge():
+    """Sidebar gauge of the shared data size and what this session adds"""
+    dataset = get_dataset()
+    with st.sidebar:
+        st.caption('Memory usage')
+        col1, col2 = st.columns(2)
+        col1.metric('Shared data', format_bytes(sum(dataset.nbytes.values())))
+        col2.metric('This session', format_bytes(session_bytes()))
+        with st.expander('Shared tables'):
+            for name, n in dataset.nbytes.items():
+                st.write(f'**{name}:** {format_bytes(n)}')
+        if dataset.memory_report is not None:
+            with st.expander('Admissions dtype compaction'):
+                st.dataframe(dataset.memory_report)
+        if dataset.load_seconds:
+            with st.expander('Startup load times'):
+                for name, seconds in dataset.load_seconds.items():
+                    st.write(f'**{name}:** {seconds:.2f} s')
+    show_figure_cache()
+
+
+def show_figure_cache():
+    """Sidebar counters of the shared figure cache"""
+    figures = get_figure_cache()
+    with st.sidebar.expander('Figure cache'):
+        st.write(f"**Hits / misses:** {figures.hits:,} / {figures.misses:,}")
+        st.write(f"**Stored:** {len(figures):,} entries, {format_bytes(figures.nbytes)} of {format_bytes(figures.max_bytes)}")
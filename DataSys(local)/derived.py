@@ -0,0 +1,58 @@
+"""Derived admission columns, computed once when the admissions table is loaded.
+
+``race_grouped`` and ``age_group`` are stored as categoricals on the shared
+admissions frame so pages only ever read them.
+"""
+import numpy as np
+import pandas as pd
+
+
+AGE_BINS = [0, 20, 40, 60, 80, 100]
+AGE_LABELS = ["<20", "21–40", "41–60", "61–80", "81–100"]
+
+# race patterns in the order they are applied, later matches win
+RACE_PATTERNS = [
+    ('WHITE', 'White'),
+    ('BLACK', 'Black'),
+    ('ASIAN', 'Asian'),
+    ('HISPANIC', 'Hispanic'),
+    ('UNKNOWN|UNABLE', 'Unknown'),
+]
+RACE_GROUPS = ['Asian', 'Black', 'Hispanic', 'Other', 'Unknown', 'White']
+
+
+def age_groups(age):
+    return pd.cut(age, bins=AGE_BINS, labels=AGE_LABELS, right=False)
+
+
+def race_groups(race):
+    """Group the many race values into a few categories
+
+    The patterns are matched once per distinct race value and the result is
+    broadcast to every row through the categorical codes.
+    """
+    race = race.astype('category')
+    names = race.cat.categories.to_series(index=range(len(race.cat.categories)))
+
+    grouped = pd.Series('Other', index=names.index)
+    for pattern, group in RACE_PATTERNS:
+        grouped[names.str.contains(pattern, case=False)] = group
+
+    # one extra slot at the end so missing races (code -1) map to 'Other'
+    lookup = np.append(
+        pd.Categorical(grouped, categories=RACE_GROUPS).codes,
+        RACE_GROUPS.index('Other'),
+    ).astype(np.int8)
+    return pd.Series(
+        pd.Categorical.from_codes(lookup[race.cat.codes.to_numpy()], categories=RACE_GROUPS),
+        index=race.index,
+        name='race_grouped',
+    )
+
+
+def add_derived_columns(admissions):
+    """Admissions with the age_group and race_grouped categoricals added"""
+    return admissions.assign(
+        age_group=age_groups(admissions['age']),
+        race_grouped=race_groups(admissions['race']),
+    )
@@ -0,0 +1,91 @@
+"""Cache of built Plotly figures shared by every session.
+
+Pages look their charts up by (page, chart id, filter state, data version)
+and only run the pandas / plotly express code that builds them on a miss.
+Entries are kept as the figures' JSON specs, so their size is known and no
+session can change a cached figure, and the least recently used ones are
+dropped once the specs pass a byte budget. On a hit the spec is loaded back
+into a figure without re-validating it, which costs a few milliseconds
+instead of a full rebuild. Figures of data that is itself only cached for a
+while can be given the same lifetime instead of a data version.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+import plotly.io as pio
+import streamlit as st
+
+
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get('HEARTTRACK_FIGURE_CACHE_MAX_BYTES', 64 * 1024 ** 2))
+
+
+class FigureCache:
+    """Serialized figure specs with a least-recently-used byte budget"""
+
+    def __init__(self, max_bytes=FIGURE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.expires = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """The cached specs of ``key``, or None"""
+        with self.lock:
+            if key in self.expires and time.monotonic() > self.expires[key]:
+                self.remove(key)
+            specs = self.entries.get(key)
+            if specs is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return specs
+
+    def remove(self, key):
+        specs = self.entries.pop(key, None)
+        self.expires.pop(key, None)
+        if specs is not None:
+            self.nbytes -= sum(len(spec) for spec in specs)
+
+    def put(self, key, specs, ttl=None):
+        """Store specs for ``ttl`` seconds (or until dropped), then drop the least recently used entries over the budget"""
+        nbytes = sum(len(spec) for spec in specs)
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = specs
+            if ttl is not None:
+                self.expires[key] = time.monotonic() + ttl
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def figures(self, key, build, ttl=None):
+        """The list of figures ``build()`` returns, from their cached specs when possible"""
+        specs = self.get(key)
+        if specs is not None:
+            return [go.Figure(json.loads(spec), _validate=False) for spec in specs]
+        figures = build()
+        self.put(key, [pio.to_json(figure, validate=False).encode() for figure in figures], ttl)
+        return figures
+
+    def figure(self, key, build, ttl=None):
+        """The figure ``build()`` returns, from its cached spec when possible"""
+        return self.figures(key, lambda: [build()], ttl)[0]
+
+
+@st.cache_resource
+def get_figure_cache():
+    """The process-wide figure cache"""
+    return FigureCache()
@@ -0,0 +1,48 @@
+"""Each patient's latest readings per vital / lab, kept up to date at ingest.
+
+The patient chart's summary view shows the newest ``LATEST_N`` readings of
+every measurement. They are picked once when a table is loaded (or written
+next to its patient store by ``python loader.py``) and rows appended later
+are merged in, so opening a chart is an index lookup instead of two sorts
+and a groupby over the patient's rows. Rows are kept in the order the chart
+draws them: by measurement, newest first.
+"""
+import os
+
+from patient_index import PatientIndex
+from rollups import MEASURES
+
+
+# readings per vital / lab type in the chart's summary view
+LATEST_N = int(os.environ.get('HEARTTRACK_LATEST_N', 10))
+
+
+def latest(df, time_col, n=LATEST_N):
+    """The newest ``n`` rows of every (patient, measurement), by patient, measurement, newest first"""
+    name_col, _ = MEASURES[time_col]
+    df = df.sort_values(
+        ['patient_id', name_col, time_col], ascending=[True, True, False], kind='stable', ignore_index=True,
+    )
+    return df.groupby(['patient_id', name_col], observed=True, sort=False).head(n).reset_index(drop=True)
+
+
+class LatestRows:
+    """The latest rows of an in-memory table, indexed by patient"""
+
+    def __init__(self, df, time_col, n=LATEST_N):
+        self.frame = latest(df, time_col, n)
+        self.index = PatientIndex(self.frame['patient_id'].to_numpy())
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, pid):
+        return pid in self.index
+
+    @property
+    def nbytes(self):
+        return int(self.frame.memory_usage(deep=True).sum()) + self.index.nbytes
+
+    def rows(self, pid):
+        """One patient's latest rows (a slice, not a copy)"""
+        return self.index.slice(self.frame, pid)
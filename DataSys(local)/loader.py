@@ -0,0 +1,422 @@
+"""Shared loader for the local fact tables.
+
+Run ``python loader.py`` once to convert the CSVs in ./tables into typed,
+compressed Parquet copies and to build the patient-partitioned stores for
+vitals and labs. Every page loads through ``load_table`` which prefers the
+Parquet copy and falls back to the CSV.
+
+Parquet copies and stores are marked with the number of CSV bytes they hold
+and a checksum of the last of them. Rows appended to a CSV afterwards do not
+make them stale: the app reads the CSV from that byte on. A CSV that was
+cut or replaced no longer matches the mark, and its copies are not used.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from derived import add_derived_columns
+from patient_store import (
+    N_BUCKETS, PatientStore, StoreBuilder, index_path, latest_root, read_manifest, rollup_root, segment_root,
+)
+from rollups import ROLLUP_LEVELS
+
+
+TABLES_DIR = './tables'
+TABLE_NAMES = ['fact_admissions', 'fact_vitals', 'fact_lab_results']
+STORE_DIR = os.path.join(TABLES_DIR, 'patient_store')
+
+# tables that get a patient-partitioned store, with the column they are sorted on
+STORE_TIME_COLUMNS = {
+    'fact_vitals': 'vital_time',
+    'fact_lab_results': 'lab_time',
+}
+
+# explicit schema for each table, columns missing from a file are skipped
+SCHEMAS = {
+    'fact_admissions': {
+        'dtype': {
+            'patient_id': 'int64',
+            'admission_id': 'int64',
+            'Hospital': 'category',
+            'admission_type': 'category',
+        },
+        'dates': [],
+    },
+    'fact_vitals': {
+        'dtype': {
+            'patient_id': 'int64',
+            'admission_id': 'int64',
+            'vital_name': 'category',
+        },
+        'dates': ['vital_time'],
+    },
+    'fact_lab_results': {
+        'dtype': {
+            'patient_id': 'int64',
+            'admission_id': 'int64',
+            'lab_type_name': 'category',
+        },
+        'dates': ['lab_time'],
+    },
+}
+
+
+# default peak memory of the chunked loader, as a fraction of the CSV size
+MEMORY_FRACTION = 0.25
+# bytes of appended rows parsed at a time
+CHUNK_BYTES = 64 << 20
+# bytes at the end of the part of a CSV a copy holds that its checksum covers
+MARK_BYTES = 1 << 16
+# Parquet metadata key of the CSV mark
+MARK_KEY = b'hearttrack.csv_mark'
+# rough bytes of memory per CSV byte while pandas parses a chunk / sorts a bucket
+PARSE_OVERHEAD = 4
+SORT_OVERHEAD = 3
+
+# columns converted to categoricals / downcast by the compaction pass
+COMPACT_COLUMNS = {
+    'fact_admissions': {
+        'categories': [
+            'Hospital',
+            'admission_location',
+            'admission_type',
+            'discharge_location',
+            'gender',
+            'race',
+            'diagnosis_description',
+        ],
+        'numeric': ['age', 'length_of_stay', 'lace_score', 'cci_score'],
+    },
+}
+
+
+def csv_path(name):
+    return os.path.join(TABLES_DIR, f'{name}.csv')
+
+
+def parquet_path(name):
+    return os.path.join(TABLES_DIR, f'{name}.parquet')
+
+
+def read_csv(name, path=None, **kwargs):
+    """Read a table CSV with its explicit schema instead of inferring dtypes"""
+    path = path or csv_path(name)
+    schema = SCHEMAS[name]
+    columns = pd.read_csv(path, nrows=0).columns
+    if hasattr(path, 'seek'):
+        path.seek(0)
+    dtype = {col: t for col, t in schema['dtype'].items() if col in columns}
+    dates = [col for col in schema['dates'] if col in columns]
+    df = pd.read_csv(path, dtype=dtype, parse_dates=dates, **kwargs)
+    # with no rows to parse the dates stay object, which the rollups cannot bucket
+    return df.astype({col: 'datetime64[us]' for col in dates}) if df.empty else df
+
+
+def csv_size(name):
+    """Current size of a table CSV in bytes, None if there is no CSV"""
+    path = csv_path(name)
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def line_end(f, size):
+    """Offset just past the last complete line of the first ``size`` bytes of a file"""
+    end = size
+    while end > 0:
+        start = max(end - MARK_BYTES, 0)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+def csv_end(name):
+    """Offset just past the last complete line of a table CSV, None if there is no CSV
+
+    A line still being written by the feed is left for the next read.
+    """
+    path = csv_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return line_end(f, os.fstat(f.fileno()).st_size)
+
+
+def read_csv_chunks(name, offset=0, end=None, chunk_bytes=CHUNK_BYTES):
+    """Rows of a table CSV from byte ``offset`` to ``end`` (its last complete line), in chunks
+
+    Yields each chunk's rows and the offset just past them, so a caller can
+    record how far it has read after every chunk.
+    """
+    with open(csv_path(name), 'rb') as f:
+        header = f.readline()
+        offset = max(offset, len(header))
+        if end is None:
+            end = line_end(f, os.fstat(f.fileno()).st_size)
+        f.seek(offset)
+        while offset < end:
+            data = f.read(min(chunk_bytes, end - offset))
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                # a single line longer than a chunk
+                data += f.readline()
+                cut = len(data)
+            f.seek(offset + cut)
+            yield read_csv(name, path=io.BytesIO(header + data[:cut])), offset + cut
+            offset += cut
+
+
+def read_csv_complete(name):
+    """Every complete line of a table CSV, and the offset just past the last one"""
+    end = csv_end(name)
+    with open(csv_path(name), 'rb') as f:
+        data = f.read(end)
+    return read_csv(name, path=io.BytesIO(data)), end
+
+
+def csv_mark(name, end):
+    """Mark of the first ``end`` bytes of a table CSV: their length and a checksum of the last of them"""
+    with open(csv_path(name), 'rb') as f:
+        f.seek(max(end - MARK_BYTES, 0))
+        return {'csv_bytes': end, 'csv_crc': zlib.crc32(f.read(min(end, MARK_BYTES)))}
+
+
+def covered_bytes(name, mark):
+    """CSV bytes a copy marked with ``mark`` holds, None if the CSV no longer starts with them"""
+    if not mark or 'csv_bytes' not in mark:
+        return None
+    size = csv_size(name)
+    if size is None:
+        # only the copy is left
+        return mark['csv_bytes']
+    if size < mark['csv_bytes'] or csv_mark(name, mark['csv_bytes'])['csv_crc'] != mark['csv_crc']:
+        return None
+    return mark['csv_bytes']
+
+
+def concat_tables(frames):
+    """Concatenate frames with the same columns, keeping categoricals categorical
+
+    New values are appended to the end of each column's categories so the
+    existing codes and category order (e.g. age bands) stay valid.
+    """
+    frames = [df for df in frames if df is not None and len(df)]
+    if len(frames) <= 1:
+        return frames[0] if frames else None
+    first = frames[0]
+    frames = [df.reindex(columns=first.columns) for df in frames]
+    for col in first.columns:
+        if not isinstance(first[col].dtype, pd.CategoricalDtype):
+            continue
+        categories = first[col].cat.categories
+        for df in frames[1:]:
+            categories = categories.append(pd.Index(df[col].dropna().unique()).difference(categories))
+        frames = [df.assign(**{col: pd.Categorical(df[col], categories=categories)}) for df in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def store_path(name):
+    return os.path.join(STORE_DIR, name)
+
+
+def parquet_mark(name):
+    """CSV mark of a table's Parquet copy, None if it has no copy or no mark"""
+    path = parquet_path(name)
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    return json.loads(metadata[MARK_KEY]) if MARK_KEY in metadata else None
+
+
+def mark_metadata(schema, mark):
+    """An Arrow schema's metadata with a CSV mark added"""
+    return {**(schema.metadata or {}), MARK_KEY: json.dumps(mark).encode()}
+
+
+def has_parquet(name):
+    return covered_bytes(name, parquet_mark(name)) is not None
+
+
+def has_store(name):
+    """True if the table's store, its rollups, latest rows and segments are built and hold a prefix of the CSV"""
+    root = store_path(name)
+    manifest = read_manifest(root)
+    if covered_bytes(name, manifest) is None:
+        return False
+    # every rollup level, a store from before they were all kept is rebuilt
+    roots = [root, latest_root(root), *(rollup_root(root, level) for level in ROLLUP_LEVELS)]
+    roots += [segment_root(root, segment) for segment in manifest.get('segments', [])]
+    return all(os.path.exists(index_path(path)) for path in roots)
+
+
+def open_store(name):
+    """Memory-mapped patient store of a table, or None if it was not built"""
+    return PatientStore(store_path(name)) if has_store(name) else None
+
+
+def read_table(name):
+    """A table and the number of bytes of its CSV it holds"""
+    csv_bytes = covered_bytes(name, parquet_mark(name))
+    if csv_bytes is not None:
+        try:
+            return pd.read_parquet(parquet_path(name)), csv_bytes
+        except ImportError:
+            pass
+    return read_csv_complete(name)
+
+
+def downcast(col):
+    """Smallest numeric dtype that holds every value of the column unchanged"""
+    if pd.api.types.is_integer_dtype(col):
+        return pd.to_numeric(col, downcast='integer')
+    if pd.api.types.is_float_dtype(col):
+        small = pd.to_numeric(col, downcast='float')
+        lossless = np.array_equal(
+            small.to_numpy(dtype=np.float64), col.to_numpy(dtype=np.float64), equal_nan=True
+        )
+        return small if lossless else col
+    return col
+
+
+def compact(df, name):
+    """Convert a table's text columns to categoricals and downcast its numerics
+
+    Returns the compacted frame and a per-column before/after memory report.
+    """
+    spec = COMPACT_COLUMNS.get(name)
+    if spec is None:
+        return df, None
+    before = df.memory_usage(deep=True, index=False)
+    before_dtypes = df.dtypes.astype(str)
+
+    df = df.assign(
+        **{col: df[col].astype('category') for col in spec['categories'] if col in df},
+        **{col: downcast(df[col]) for col in spec['numeric'] if col in df},
+    )
+
+    after = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'before dtype': before_dtypes,
+        'after dtype': df.dtypes.astype(str),
+        'before bytes': before,
+        'after bytes': after,
+    })
+    report.loc['total'] = ['', '', before.sum(), after.sum()]
+    return df, report
+
+
+def load_table(name):
+    """Load a fact table, preferring the columnar copy over the CSV
+
+    Returns the table, the number of bytes of its CSV it holds and the
+    per-column memory report of the compaction pass (None for tables that
+    are not compacted).
+    """
+    df, csv_bytes = read_table(name)
+    df, memory_report = compact(df, name)
+    if name == 'fact_admissions':
+        df = add_derived_columns(df)
+    return df, csv_bytes, memory_report
+
+
+def convert_table(name):
+    """Write a typed, zstd-compressed Parquet copy of one table CSV, marked with the bytes it holds"""
+    df, end = read_csv_complete(name)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(mark_metadata(table.schema, csv_mark(name, end)))
+    tmp_parquet = parquet_path(name) + '.tmp'
+    pq.write_table(table, tmp_parquet, compression='zstd')
+    os.replace(tmp_parquet, parquet_path(name))
+    return df
+
+
+def chunk_plan(name, memory_fraction=MEMORY_FRACTION):
+    """Bytes per chunk and number of store buckets for a memory budget
+
+    The budget is ``memory_fraction`` of the CSV size. Chunks are small
+    enough to parse within it, and buckets small enough that sorting one of
+    them also fits in it.
+    """
+    size = os.path.getsize(csv_path(name))
+    budget = max(memory_fraction * size, 1)
+    chunk_bytes = max(int(budget / PARSE_OVERHEAD), 1 << 16)
+    n_buckets = max(N_BUCKETS, math.ceil(size * SORT_OVERHEAD / budget))
+    return chunk_bytes, n_buckets
+
+
+def ingest_chunked(name, memory_fraction=MEMORY_FRACTION, progress=None):
+    """Stream a table CSV into its Parquet copy and patient store in bounded memory
+
+    Both are marked with the CSV bytes they hold. ``progress(stage,
+    fraction, rows)`` is called after every chunk and every finished bucket.
+    Returns the number of rows ingested.
+    """
+    chunk_bytes, n_buckets = chunk_plan(name, memory_fraction)
+    builder = StoreBuilder(store_path(name), STORE_TIME_COLUMNS[name], n_buckets)
+    end = csv_end(name)
+    mark = csv_mark(name, end)
+    tmp_parquet = parquet_path(name) + '.tmp'
+    writer = None
+    rows = 0
+
+    for chunk, offset in read_csv_chunks(name, 0, end, chunk_bytes):
+        table = builder.add(chunk)
+        if writer is None:
+            schema = table.schema.with_metadata(mark_metadata(table.schema, mark))
+            writer = pq.ParquetWriter(tmp_parquet, schema, compression='zstd')
+        writer.write_table(table)
+        rows += len(chunk)
+        if progress:
+            progress('reading', offset / end, rows)
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_parquet, parquet_path(name))
+    else:
+        # a CSV without rows still gives the store its columns
+        builder.add(read_csv(name, nrows=0))
+
+    def sorting(fraction):
+        if progress:
+            progress('sorting', fraction, rows)
+
+    builder.finish(sorting, mark)
+    return rows
+
+
+def print_progress(name):
+    def progress(stage, fraction, rows):
+        print(f'\r{name}: {stage} {fraction:6.1%} ({rows:,} rows)', end='', flush=True)
+    return progress
+
+
+def main(names, memory_fraction=MEMORY_FRACTION):
+    for name in names or TABLE_NAMES:
+        if name not in SCHEMAS:
+            raise SystemExit(f'Unknown table: {name}')
+        if name in STORE_TIME_COLUMNS:
+            # vitals/labs can be larger than RAM, so they are streamed in chunks
+            rows = ingest_chunked(name, memory_fraction, print_progress(name))
+            print(f'\r{name}: {rows:,} rows -> {parquet_path(name)}, {store_path(name)}')
+        else:
+            df = convert_table(name)
+            print(f'{name}: {len(df):,} rows -> {parquet_path(name)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the CSV tables to Parquet and patient stores')
+    parser.add_argument('tables', nargs='*', help='tables to convert (default: all)')
+    parser.add_argument(
+        '--memory-fraction', type=float, default=MEMORY_FRACTION,
+        help='peak memory for vitals/labs as a fraction of the CSV size (default: %(default)s)',
+    )
+    args = parser.parse_args()
+    main(args.tables, args.memory_fraction)
@@ -4,6 +4,8 @@ import altair as alt
 import plotly.express as pxpress
 import yaml
 import streamlit_authenticator as stauth
+from dataset import get_dataset, show_memory_gauge
+from figure_cache import get_figure_cache
 
 st.set_page_config(
     page_title="Total Admissions", layout='wide')
@@ -11,64 +13,42 @@ st.title('Overall Admissions')
 
 
 
-#load the admissions fact table
-admissions = pd.read_csv('./tables/fact_admissions.csv')
+#precomputed aggregates of the shared admissions table (built once per process)
+dataset = get_dataset()
+cube = dataset.cube
+kpis = cube.kpis()
+show_memory_gauge()
 
 
 
 #show key metrics
 col1, col2, col3 = st.columns(3)
-col1.metric('Total Patients', admissions['patient_id'].nunique())
-col2.metric('Total Admissions', admissions['admission_id'].nunique())
-col3.metric('Average Age', admissions['age'].mean().round(2))
+col1.metric('Total Patients', int(kpis['patients']))
+col2.metric('Total Admissions', int(kpis['admissions']))
+col3.metric('Average Age', round(kpis['age'], 2))
 
 
 #another subcolumn with key metrics
 col4, col5, col6 = st.columns(3)
-col4.metric('Average Length of Stay', admissions['length_of_stay'].mean().round(2))
-col5.metric('Average LACE Score', admissions['lace_score'].mean().round(2))
-col6.metric('Averange CCI Score', admissions['cci_score'].mean().round(2))
-
-
-# get admissions by hospital
-admissions_by_hospital = (
-    admissions.groupby('Hospital')['admission_id']
-    .nunique()
-    .reset_index(name='Number of Admissions Per Hospital')
-)
-
-# admissions by admission location
-admitted_from = (
-    admissions.groupby('admission_location')['admission_id']
-    .nunique()
-    .reset_index(name='Number of Admissions From Location')
-)
-
-#admission by type 
-admissions_by_type = (
-    admissions.groupby('admission_type')['admission_id']
-    .nunique()
-    .reset_index(name='Number of Admissions Per Type')
-)
-
-#discharge locations
-discharge_locations = (
-    admissions.groupby('discharge_location')['admission_id']
-    .nunique()
-    .reset_index(name='Number of Admissions Per Discharge Location')
-)
+col4.metric('Average Length of Stay', round(kpis['length_of_stay'], 2))
+col5.metric('Average LACE Score', round(kpis['lace_score'], 2))
+col6.metric('Averange CCI Score', round(kpis['cci_score'], 2))
 
 
-# subheader
-st.subheader("Admissions by Hospital")
-#  2 columns for charts
-col7, col8 = st.columns(2)
+#charts are built once per data version and shared by every session
+figures = get_figure_cache()
 
-# admissions by hospital bar chart
-with col7:
+
+def chart(chart_id, build):
+    return figures.figure(('main', chart_id, (), dataset.version), build)
+
+
+def hospital_chart():
+    # get admissions by hospital
+    admissions_by_hospital = cube.breakdown('Hospital', 'admissions', 'Number of Admissions Per Hospital')
     admissions_by_hospital_sorted = admissions_by_hospital.sort_values("Number of Admissions Per Hospital", ascending=False)
 
-    hospital_chart = pxpress.bar(
+    fig = pxpress.bar(
         admissions_by_hospital_sorted,
         x='Number of Admissions Per Hospital',
         y='Hospital',
@@ -77,8 +57,8 @@ with col7:
         color='Hospital',
         color_discrete_sequence=pxpress.colors.qualitative.Pastel
     )
-    hospital_chart.update_traces(width=0.6)
-    hospital_chart.update_layout(
+    fig.update_traces(width=0.6)
+    fig.update_layout(
         yaxis=dict(
             automargin=True,
             ticklabelposition="outside"
@@ -88,13 +68,15 @@ with col7:
         showlegend=False,
         height=600
     )
-    st.plotly_chart(hospital_chart, use_container_width=True)
+    return fig
 
-# admissions by location bar chart
-with col8:
+
+def location_chart():
+    # admissions by admission location
+    admitted_from = cube.breakdown('admission_location', 'admissions', 'Number of Admissions From Location')
     admitted_from_sorted = admitted_from.sort_values("Number of Admissions From Location", ascending=False)
 
-    location_chart = pxpress.bar(
+    fig = pxpress.bar(
         admitted_from_sorted,
         x='Number of Admissions From Location',
         y='admission_location',
@@ -103,8 +85,8 @@ with col8:
         color='admission_location',
         color_discrete_sequence=pxpress.colors.qualitative.Pastel
     )
-    location_chart.update_traces(width=0.6)
-    location_chart.update_layout(
+    fig.update_traces(width=0.6)
+    fig.update_layout(
         yaxis=dict(
             automargin=True,
             ticklabelposition="outside"
@@ -114,15 +96,15 @@ with col8:
         showlegend=False,
         height=600
     )
-    st.plotly_chart(location_chart, use_container_width=True)
+    return fig
 
-# admissions by type bar chart
-st.subheader("Admissions by Type")
-col9, col10 = st.columns(2)
-with col9:
+
+def type_chart():
+    #admission by type 
+    admissions_by_type = cube.breakdown('admission_type', 'admissions', 'Number of Admissions Per Type')
     admissions_by_type_sorted = admissions_by_type.sort_values("Number of Admissions Per Type", ascending=False)
 
-    type_chart = pxpress.bar(
+    fig = pxpress.bar(
         admissions_by_type_sorted,
         x='Number of Admissions Per Type',
         y='admission_type',
@@ -131,8 +113,8 @@ with col9:
         color='admission_type',
         color_discrete_sequence=pxpress.colors.qualitative.Pastel
     )
-    type_chart.update_traces(width=0.6)
-    type_chart.update_layout(
+    fig.update_traces(width=0.6)
+    fig.update_layout(
         yaxis=dict(
             automargin=True,
             ticklabelposition="outside"
@@ -142,13 +124,15 @@ with col9:
         showlegend=False,
         height=600
     )
-    st.plotly_chart(type_chart, use_container_width=True)
+    return fig
 
-# discharge locations bar chart
-with col10:
+
+def discharge_chart():
+    #discharge locations
+    discharge_locations = cube.breakdown('discharge_location', 'admissions', 'Number of Admissions Per Discharge Location')
     discharge_locations_sorted = discharge_locations.sort_values("Number of Admissions Per Discharge Location", ascending=False)
 
-    discharge_chart = pxpress.bar(
+    fig = pxpress.bar(
         discharge_locations_sorted,
         x='Number of Admissions Per Discharge Location',
         y='discharge_location',
@@ -157,8 +141,8 @@ with col10:
         color='discharge_location',
         color_discrete_sequence=pxpress.colors.qualitative.Pastel
     )
-    discharge_chart.update_traces(width=0.6)
-    discharge_chart.update_layout(
+    fig.update_traces(width=0.6)
+    fig.update_layout(
         yaxis=dict(
             automargin=True,
             ticklabelposition="outside"
@@ -168,61 +152,43 @@ with col10:
         showlegend=False,
         height=600
     )
-    st.plotly_chart(discharge_chart, use_container_width=True)
-
+    return fig
 
 
+# subheader
+st.subheader("Admissions by Hospital")
+#  2 columns for charts
+col7, col8 = st.columns(2)
 
-#create demongraphcs
-pt_by_gender = (
-    admissions.replace({'gender': {'M': 'Male', 'F': 'Female'}})
-    .groupby('gender')['patient_id']
-    .nunique()
-    .reset_index(name='Number of Patients')
-    .rename(columns={'gender': 'Gender'})
-)
-
-pt_by_age_group = (
-    admissions.assign(
-        age_group=pd.cut(
-            admissions["age"],
-            bins=[0, 20, 40, 60, 80, 100],
-            labels=["<20", "21–40", "41–60", "61–80", "81–100"],
-            right=False
-        )
-    )
-    .groupby("age_group")["patient_id"]
-    .nunique()
-    .reset_index(name="Number of Patients")
-    .rename(columns={"age_group": "Age Group"})
-)
+# admissions by hospital bar chart
+with col7:
+    st.plotly_chart(chart('hospital', hospital_chart), use_container_width=True)
 
-#Need to group the races because tehre are too many categories
-admissions['race_grouped'] = 'Other'
+# admissions by location bar chart
+with col8:
+    st.plotly_chart(chart('location', location_chart), use_container_width=True)
 
-admissions.loc[admissions['race'].str.contains('WHITE', case=False, na=False), 'race_grouped'] = 'White'
-admissions.loc[admissions['race'].str.contains('BLACK', case=False, na=False), 'race_grouped'] = 'Black'
-admissions.loc[admissions['race'].str.contains('ASIAN', case=False, na=False), 'race_grouped'] = 'Asian'
-admissions.loc[admissions['race'].str.contains('HISPANIC', case=False, na=False), 'race_grouped'] = 'Hispanic'
-admissions.loc[admissions['race'].str.contains('UNKNOWN|UNABLE', case=False, na=False), 'race_grouped'] = 'Unknown'
+# admissions by type bar chart
+st.subheader("Admissions by Type")
+col9, col10 = st.columns(2)
+with col9:
+    st.plotly_chart(chart('type', type_chart), use_container_width=True)
 
-pt_by_race = (
-    admissions.groupby('race_grouped')['patient_id']
-    .nunique()
-    .reset_index(name='Number of Patients')
-    .rename(columns={'race_grouped': 'Race'})
-)
+# discharge locations bar chart
+with col10:
+    st.plotly_chart(chart('discharge', discharge_chart), use_container_width=True)
 
 
-#visualise patient demographics
-st.subheader("Patient Demographics")
 
-# Create 2 columns for charts
-col11, col12, col13= st.columns(3)
 
-# gender pie chart
-with col11:
-    gender_chart = pxpress.pie(
+#create demongraphcs
+def gender_chart():
+    pt_by_gender = (
+        cube.breakdown('gender', 'patients', 'Number of Patients')
+        .replace({'gender': {'M': 'Male', 'F': 'Female'}})
+        .rename(columns={'gender': 'Gender'})
+    )
+    return pxpress.pie(
         pt_by_gender,
         names='Gender',
         values='Number of Patients',
@@ -231,11 +197,14 @@ with col11:
         color_discrete_map={'Male': 'lightblue', 'Female': 'lightpink'},
         hole=0.5
     )
-    st.plotly_chart(gender_chart, use_container_width=True)
 
-# age chart
-with col12:
-    age_chart = pxpress.bar(
+
+def age_chart():
+    pt_by_age_group = (
+        cube.breakdown('age_group', 'patients', 'Number of Patients')
+        .rename(columns={"age_group": "Age Group"})
+    )
+    fig = pxpress.bar(
         pt_by_age_group,
         x="Age Group", 
         y="Number of Patients",
@@ -244,12 +213,17 @@ with col12:
         color="Age Group",
         color_discrete_sequence=pxpress.colors.qualitative.Pastel
     )
-    age_chart.update_traces(width=1.0)
-    st.plotly_chart(age_chart, use_container_width=True)
+    fig.update_traces(width=1.0)
+    return fig
 
-#race chart
-with col13:
-    race_chart = pxpress.pie(
+
+def race_chart():
+    #races are grouped into a few categories when the cube is built
+    pt_by_race = (
+        cube.breakdown('race_grouped', 'patients', 'Number of Patients')
+        .rename(columns={'race_grouped': 'Race'})
+    )
+    return pxpress.pie(
         pt_by_race,
         names='Race',
         values='Number of Patients',
@@ -258,4 +232,22 @@ with col13:
         color_discrete_sequence=pxpress.colors.qualitative.Pastel,
         hole=0.3
     )
-    st.plotly_chart(race_chart, use_container_width=True)
\ No newline at end of file
+
+
+#visualise patient demographics
+st.subheader("Patient Demographics")
+
+# Create 2 columns for charts
+col11, col12, col13= st.columns(3)
+
+# gender pie chart
+with col11:
+    st.plotly_chart(chart('gender', gender_chart), use_container_width=True)
+
+# age chart
+with col12:
+    st.plotly_chart(chart('age', age_chart), use_container_width=True)
+
+#race chart
+with col13:
+    st.plotly_chart(chart('race', race_chart), use_container_width=True)
\ No newline at end of file
@@ -1,37 +1,64 @@
 import streamlit as st
 import pandas as pd
+from dataset import get_dataset, show_memory_gauge
 import plotly.express as pxpress
+from figure_cache import get_figure_cache
 
 
-if 'admissions' not in st.session_state:
-    st.session_state.admissions = pd.read_csv('./tables/fact_admissions.csv')
+#precomputed aggregates of the shared admissions table (built once per process)
+dataset = get_dataset()
+cube = dataset.cube
+distinct = dataset.distinct
+show_memory_gauge()
 
-admissions_full = st.session_state.admissions
-
-hospital_list = admissions_full["Hospital"].dropna().unique()
-hospital_list.sort()
+hospital_list = cube.hospitals()
 selected_hospital = st.selectbox("Select a Hospital", options=hospital_list)
 
-admissions = admissions_full[admissions_full["Hospital"] == selected_hospital]
+#optional demographic filters, answered from the bitmap index
+filter_cols = st.columns(3)
+filters = {
+    'gender': filter_cols[0].multiselect(
+        "Gender", distinct.values('gender'),
+        format_func=lambda g: {'M': 'Male', 'F': 'Female'}.get(g, g)
+    ),
+    'age_group': filter_cols[1].multiselect("Age Group", distinct.values('age_group')),
+    'race_grouped': filter_cols[2].multiselect("Ethnicity", distinct.values('race_grouped')),
+}
+filters = {dim: values for dim, values in filters.items() if values}
+
+
+def breakdown(dimension, count, name):
+    if filters:
+        return distinct.breakdown(dimension, count, name, {'Hospital': [selected_hospital], **filters})
+    return cube.breakdown(dimension, count, name, selected_hospital)
+
+
+if filters:
+    kpis = distinct.kpis({'Hospital': [selected_hospital], **filters})
+else:
+    kpis = cube.kpis(selected_hospital)
 
 col1, col2, col3 = st.columns(3)
-col1.metric('Total Patients', admissions['patient_id'].nunique())
-col2.metric('Total Admissions', admissions['admission_id'].nunique())
-col3.metric('Average Age', round(admissions['age'].mean(), 2))
+col1.metric('Total Patients', int(kpis['patients']))
+col2.metric('Total Admissions', int(kpis['admissions']))
+col3.metric('Average Age', round(kpis['age'], 2))
 
 col4, col5, col6 = st.columns(3)
-col4.metric('Average Length of Stay', round(admissions['length_of_stay'].mean(), 2))
-col5.metric('Average LACE Score', round(admissions['lace_score'].mean(), 2))
-col6.metric('Average CCI Score', round(admissions['cci_score'].mean(), 2))
+col4.metric('Average Length of Stay', round(kpis['length_of_stay'], 2))
+col5.metric('Average LACE Score', round(kpis['lace_score'], 2))
+col6.metric('Average CCI Score', round(kpis['cci_score'], 2))
 
-admitted_from = admissions.groupby('admission_location')['admission_id'].nunique().reset_index(name='Number of Admissions From Location')
-admissions_by_type = admissions.groupby('admission_type')['admission_id'].nunique().reset_index(name='Number of Admissions Per Type')
-discharge_locations = admissions.groupby('discharge_location')['admission_id'].nunique().reset_index(name='Number of Admissions Per Discharge Location')
+#charts are built once per hospital, filters and data version, and shared by every session
+figures = get_figure_cache()
+view = (selected_hospital, tuple((dim, tuple(values)) for dim, values in filters.items()))
 
-st.subheader("Admissions Overview")
-col7, col8, col9 = st.columns(3)
 
-with col7:
+def chart(chart_id, build):
+    return figures.figure(('byhospital', chart_id, view, dataset.version), build)
+
+
+def location_chart():
+    admitted_from = breakdown('admission_location', 'admissions', 'Number of Admissions From Location')
     admitted_from_sorted = admitted_from.sort_values("Number of Admissions From Location", ascending=False)
     fig1 = pxpress.bar(
         admitted_from_sorted,
@@ -44,9 +71,11 @@ with col7:
     )
     fig1.update_layout(yaxis_title="Admission Location", xaxis_title="Admissions", showlegend=False)
     fig1.update_traces(marker_line_width=1.5, marker_line_color='gray', width=0.6)
-    st.plotly_chart(fig1, use_container_width=True)
+    return fig1
 
-with col8:
+
+def type_chart():
+    admissions_by_type = breakdown('admission_type', 'admissions', 'Number of Admissions Per Type')
     admissions_by_type_sorted = admissions_by_type.sort_values("Number of Admissions Per Type", ascending=False)
     fig2 = pxpress.bar(
         admissions_by_type_sorted,
@@ -59,9 +88,11 @@ with col8:
     )
     fig2.update_layout(yaxis_title="Admission Type", xaxis_title="Admissions", showlegend=False)
     fig2.update_traces(marker_line_width=1.5, marker_line_color='gray', width=0.6)
-    st.plotly_chart(fig2, use_container_width=True)
+    return fig2
 
-with col9:
+
+def discharge_chart():
+    discharge_locations = breakdown('discharge_location', 'admissions', 'Number of Admissions Per Discharge Location')
     discharge_locations_sorted = discharge_locations.sort_values("Number of Admissions Per Discharge Location", ascending=False)
     fig3 = pxpress.bar(
         discharge_locations_sorted,
@@ -74,58 +105,30 @@ with col9:
     )
     fig3.update_layout(yaxis_title="Discharge Location", xaxis_title="Admissions", showlegend=False)
     fig3.update_traces(marker_line_width=1.5, marker_line_color='gray', width=0.6)
-    st.plotly_chart(fig3, use_container_width=True)
-
-    #create demongraphcs
-pt_by_gender = (
-    admissions.replace({'gender': {'M': 'Male', 'F': 'Female'}})
-    .groupby('gender')['patient_id']
-    .nunique()
-    .reset_index(name='Number of Patients')
-    .rename(columns={'gender': 'Gender'})
-)
-
-pt_by_age_group = (
-    admissions.assign(
-        age_group=pd.cut(
-            admissions["age"],
-            bins=[0, 20, 40, 60, 80, 100],
-            labels=["<20", "21–40", "41–60", "61–80", "81–100"],
-            right=False
-        )
-    )
-    .groupby("age_group")["patient_id"]
-    .nunique()
-    .reset_index(name="Number of Patients")
-    .rename(columns={"age_group": "Age Group"})
-)
+    return fig3
 
-#Need to group the races because tehre are too many categories
-admissions['race_grouped'] = 'Other'
 
-admissions.loc[admissions['race'].str.contains('WHITE', case=False, na=False), 'race_grouped'] = 'White'
-admissions.loc[admissions['race'].str.contains('BLACK', case=False, na=False), 'race_grouped'] = 'Black'
-admissions.loc[admissions['race'].str.contains('ASIAN', case=False, na=False), 'race_grouped'] = 'Asian'
-admissions.loc[admissions['race'].str.contains('HISPANIC', case=False, na=False), 'race_grouped'] = 'Hispanic'
-admissions.loc[admissions['race'].str.contains('UNKNOWN|UNABLE', case=False, na=False), 'race_grouped'] = 'Unknown'
+st.subheader("Admissions Overview")
+col7, col8, col9 = st.columns(3)
 
-pt_by_race = (
-    admissions.groupby('race_grouped')['patient_id']
-    .nunique()
-    .reset_index(name='Number of Patients')
-    .rename(columns={'race_grouped': 'Race'})
-)
+with col7:
+    st.plotly_chart(chart('location', location_chart), use_container_width=True)
 
+with col8:
+    st.plotly_chart(chart('type', type_chart), use_container_width=True)
 
-#visualise patient demographics
-st.subheader("Patient Demographics")
+with col9:
+    st.plotly_chart(chart('discharge', discharge_chart), use_container_width=True)
 
-# Create 2 columns for charts
-col11, col12, col13= st.columns(3)
 
-# gender pie chart
-with col11:
-    gender_chart = pxpress.pie(
+#create demongraphcs
+def gender_chart():
+    pt_by_gender = (
+        breakdown('gender', 'patients', 'Number of Patients')
+        .replace({'gender': {'M': 'Male', 'F': 'Female'}})
+        .rename(columns={'gender': 'Gender'})
+    )
+    return pxpress.pie(
         pt_by_gender,
         names='Gender',
         values='Number of Patients',
@@ -134,11 +137,14 @@ with col11:
         color_discrete_map={'Male': 'lightblue', 'Female': 'lightpink'},
         hole=0.5
     )
-    st.plotly_chart(gender_chart, use_container_width=True)
 
-# age chart
-with col12:
-    age_chart = pxpress.bar(
+
+def age_chart():
+    pt_by_age_group = (
+        breakdown('age_group', 'patients', 'Number of Patients')
+        .rename(columns={"age_group": "Age Group"})
+    )
+    return pxpress.bar(
         pt_by_age_group,
         x="Age Group", 
         y="Number of Patients",
@@ -148,11 +154,14 @@ with col12:
         color_discrete_sequence=pxpress.colors.qualitative.Pastel
     )
 
-    st.plotly_chart(age_chart, use_container_width=True)
 
-#race chart
-with col13:
-    race_chart = pxpress.pie(
+def race_chart():
+    #races are grouped into a few categories when the cube is built
+    pt_by_race = (
+        breakdown('race_grouped', 'patients', 'Number of Patients')
+        .rename(columns={'race_grouped': 'Race'})
+    )
+    return pxpress.pie(
         pt_by_race,
         names='Race',
         values='Number of Patients',
@@ -161,4 +170,22 @@ with col13:
         color_discrete_sequence=pxpress.colors.qualitative.Pastel,
         hole=0.3
     )
-    st.plotly_chart(race_chart, use_container_width=True)
+
+
+#visualise patient demographics
+st.subheader("Patient Demographics")
+
+# Create 2 columns for charts
+col11, col12, col13= st.columns(3)
+
+# gender pie chart
+with col11:
+    st.plotly_chart(chart('gender', gender_chart), use_container_width=True)
+
+# age chart
+with col12:
+    st.plotly_chart(chart('age', age_chart), use_container_width=True)
+
+#race chart
+with col13:
+    st.plotly_chart(chart('race', race_chart), use_container_width=True)
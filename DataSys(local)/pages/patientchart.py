@@ -1,6 +1,10 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
+from datetime import timedelta
+from dataset import get_dataset, show_memory_gauge
+from patient_charts import patient_figures
+from prefetch import join_prefetch
 
 st.set_page_config(page_title="BTF Vitals View", layout="wide")
 
@@ -16,29 +20,26 @@ st.title(f"Patient Chart for: {pid}")
 if st.button("Return to Patient List"):
     st.switch_page("pages/patientlist.py")
 
-# Load data
-vitals = pd.read_csv('./tables/fact_vitals.csv')
-labs = pd.read_csv('./tables/fact_lab_results.csv')
+# shared vitals and labs (loaded once per process)
+dataset = get_dataset()
+show_memory_gauge()
 
-#only load the data for the selected patient
-vitals = vitals[vitals["patient_id"] == pid]
-labs = labs[labs["patient_id"] == pid]
-
-#get the latest (10) vitals and labs 
-latest_vitals_df = (
-    vitals.sort_values("vital_time", ascending=False)
-    .groupby("vital_name")
-    .head(10)
-    .sort_values(["vital_name", "vital_time"], ascending=[True, False])
-)
-
-latest_labs_df = (
-    labs.sort_values("lab_time", ascending=False)
-    .groupby("lab_type_name")
-    .head(10)
-    .sort_values(["lab_type_name", "lab_time"], ascending=[True, False])
+#latest readings per vital / lab (10 by default, see latest.py), or every reading of the stay drawn with WebGL
+full_history = st.toggle(
+    "Full history",
+    help="Show every reading, downsampled on the server to about one point per pixel",
 )
 
+#window of the stay to chart, long windows are drawn from precomputed rollups
+window = None
+if full_history:
+    time_span = dataset.time_span(pid)
+    if time_span is not None:
+        first, last = (t.to_pydatetime() for t in time_span)
+        window = st.slider(
+            "Window", min_value=first, max_value=last, value=(first, last),
+            step=timedelta(hours=1), format="YYYY-MM-DD HH:mm",
+        )
 
 #visualse the vitals
 def plot_vitals(vitals_df):
@@ -68,59 +69,23 @@ def plot_labs(labs_df):
     fig.update_layout(title="Labs Over Time", xaxis_title="Time", yaxis_title="Value")
     return fig
 
-if latest_vitals_df.empty:
+#the patient's charts are built once per data version and shared by every session,
+#usually already by the prefetch started when the patient was selected in the list
+join_prefetch(pid)
+vitals_charts = patient_figures(dataset, 'vitals', pid, full_history, window)
+lab_charts = patient_figures(dataset, 'labs', pid, full_history, window)
+
+if all(len(fig.data[0].x) == 0 for fig in vitals_charts):
     st.warning("No vital signs available for this patient.")
 
 # display vitals in 2 columns
 st.subheader("Vitals")
 vital_cols = st.columns(2)
-ordered_vitals = ["SBP", "Heart Rate", "DBP", "SpO2"]
-vital_colors = {
-    "SBP": "red",
-    "DBP": "red",
-    "SpO2": "blue",
-    "Heart Rate": "green"
-}
-for i, vital_name in enumerate(ordered_vitals):
-    df = latest_vitals_df[latest_vitals_df["vital_name"] == vital_name]
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df["vital_time"],
-        y=df["vital_reading"],
-        mode='lines+markers',
-        name=vital_name,
-        line=dict(color=vital_colors.get(vital_name, 'gray')),
-        marker=dict(color=vital_colors.get(vital_name, 'gray'), size=10)
-    ))
-    fig.update_layout(title=f"{vital_name} Over Time", xaxis_title="Time", yaxis_title="Result")
+for i, fig in enumerate(vitals_charts):
     vital_cols[i % 2].plotly_chart(fig, use_container_width=True)
 
 # display labs in 4 columns
 st.subheader("Labs")
 lab_cols = st.columns(3)
-# Color mapping for labs (high-contrast for grey/white background)
-lab_colors = {
-    "Creatinine": "#0044cc",     # vivid blue
-    "Hemoglobin": "#cc0000",     # deep red
-    "Magnesium": "#7e00cc",      # dark purple
-    "NT-proBNP": "#ff6600",      # bright orange
-    "Potassium": "#007a29",      # deep green
-    "Sodium": "#008080",         # dark teal
-    "Troponin T": "#ffcc00",     # golden yellow
-    "eGFR": "#5c4033"            # dark brown
-}
-for i, lab_type_name in enumerate(latest_labs_df["lab_type_name"].unique()):
-    df = latest_labs_df[latest_labs_df["lab_type_name"] == lab_type_name]
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df["lab_time"],
-        y=df["lab_value"],
-        mode='lines+markers',
-        name=lab_type_name,
-        line=dict(color=lab_colors.get(lab_type_name, 'gray')),
-        marker=dict(color=lab_colors.get(lab_type_name, 'gray'), size=10),
-        
-
-    ))
-    fig.update_layout(title=f"{lab_type_name} Over Time", xaxis_title="Time", yaxis_title="Result")
+for i, fig in enumerate(lab_charts):
     lab_cols[i % 3].plotly_chart(fig, use_container_width=True)
@@ -1,63 +1,49 @@
 import streamlit as st
 import pandas as pd
+from dataset import get_dataset, show_memory_gauge
+from patient_charts import prefetch_steps
+from patient_list import show_pager
+from prefetch import cancel_prefetch, prefetch
 
 st.set_page_config(page_title="Patient List", layout="wide")
 st.title("Patient List by Hospital")
 
-#check if the admissions dataframe is already loaded but if not, load it
-if 'admissions' not in st.session_state:
-    st.session_state.admissions = pd.read_csv('./tables/fact_admissions.csv')
+#shared per-hospital patient tables, only the filters and page below are per session
+dataset = get_dataset()
+patient_list = dataset.patient_list
+show_memory_gauge()
 
-admissions = st.session_state.admissions
-
-hospital_list = admissions["Hospital"].dropna().unique()
-hospital_list.sort()
+hospital_list = patient_list.hospitals()
 selected_hospital = st.selectbox("Select a Hospital", options=hospital_list)
 
-filtered = admissions[admissions["Hospital"] == selected_hospital]
-
 search_query = st.text_input("Search Patients", placeholder="Search by patient ID")
+text_query = st.text_input("Search Reason for Admission", placeholder="e.g. chronic heart failure")
+
+#search boxes for patient ID and reason for admission, rows are positions in the hospital's patient table
+rows = patient_list.search(selected_hospital, search_query, text_query)
+
+#only the visible page is sent to the browser
+start, stop = show_pager(len(rows), (selected_hospital, search_query, text_query))
+patient_table = patient_list.page(selected_hospital, rows, start, stop)
 
-#search box for patient ID
-if search_query:
-    filtered = filtered[
-        filtered["patient_id"].astype(str).str.contains(search_query, case=False, na=False) 
-    ]
-
-#display the filtered patient list
-patient_table = filtered[[
-    "patient_id",
-    "age",
-    "gender",
-    "diagnosis_description",
-    "length_of_stay",
-    "lace_score",
-    "cci_score"
-]].rename(columns={
-    "diagnosis_description": "Reason for Admission",
-    "lace_score": "LACE Score",
-    "cci_score": "CCI Score"
-}).drop_duplicates()
-
-
-#use 
-patient_table["Select"] = False
-edited_table = st.data_editor(
+event = st.dataframe(
     patient_table,
     use_container_width=True,
-    num_rows="dynamic",
-    disabled=["patient_id", "age", "gender", "Reason for Admission", "LACE Score", "CCI Score"]
+    hide_index=True,
+    on_select="rerun",
+    selection_mode="single-row",
 )
 
-selected_rows = edited_table[edited_table["Select"] == True]
+selected_rows = event.selection.rows
 
 if len(selected_rows) == 1:
-    selected_pid = selected_rows.iloc[0]["patient_id"]
+    selected_pid = patient_table.iloc[selected_rows[0]]["patient_id"]
     st.session_state.selected_patient_id = selected_pid
+    #warm the patient's charts in the background while the button is not clicked yet
+    prefetch(selected_pid, prefetch_steps(dataset, selected_pid))
     st.markdown(f"### Selected Patient ID: {selected_pid}")
     if st.button("Go to Patient Chart"):
         st.switch_page("pages/patientchart.py")
-elif len(selected_rows) > 1:
-    st.warning("Please select only one patient.")
 else:
-    st.info("Select a patient from the table to view their chart.")
\ No newline at end of file
+    cancel_prefetch()
+    st.info("Select a patient from the table to view their chart.")
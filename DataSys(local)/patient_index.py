@@ -0,0 +1,68 @@
+"""Per-patient row index for the vitals and labs fact tables.
+
+Tables are sorted by (patient_id, time) once at load time, so every
+patient's rows are contiguous. ``PatientIndex`` maps a patient_id to its
+[start, end) row range, which makes opening a chart a binary search plus a
+slice instead of a boolean scan of the whole table.
+"""
+import numpy as np
+
+
+def sort_by_patient(df, time_col):
+    """Sort a fact table by (patient_id, time) with a fresh 0..n index"""
+    return df.sort_values(['patient_id', time_col], kind='stable', ignore_index=True)
+
+
+class PatientIndex:
+    """Maps patient_id to the [start, end) rows of a patient-sorted table"""
+
+    def __init__(self, patient_ids):
+        patient_ids = np.asarray(patient_ids)
+        starts = np.flatnonzero(np.diff(patient_ids)) + 1
+        starts = np.concatenate([[0], starts]) if len(patient_ids) else starts
+        self.ids = patient_ids[starts]
+        self.offsets = np.append(starts, len(patient_ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, pid):
+        start, end = self.range(pid)
+        return end > start
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.offsets.nbytes
+
+    def range(self, pid):
+        """Row range of one patient, (0, 0) if the patient has no rows"""
+        i = np.searchsorted(self.ids, pid)
+        if i == len(self.ids) or self.ids[i] != pid:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def slice(self, df, pid):
+        """One patient's rows of the indexed table, without copying"""
+        start, end = self.range(pid)
+        return df.iloc[start:end]
+
+
+class PatientRows:
+    """An in-memory table sorted by (patient_id, time) with its PatientIndex"""
+
+    def __init__(self, df, time_col):
+        self.frame = sort_by_patient(df, time_col)
+        self.index = PatientIndex(self.frame['patient_id'].to_numpy())
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, pid):
+        return pid in self.index
+
+    def rows(self, pid):
+        """One patient's rows (a slice, not a copy)"""
+        return self.index.slice(self.frame, pid)
+
+    def max(self, column):
+        return self.frame[column].max() if len(self.frame) else None
@@ -0,0 +1,416 @@
+"""Patient-partitioned, memory-mapped store for the vitals and labs tables.
+
+``build_store`` splits a fact table into hash buckets on patient_id and
+writes each bucket as an uncompressed Arrow IPC file sorted by
+(patient_id, time), plus one sorted index of (patient_id, bucket, start, end).
+``PatientStore`` memory-maps both, so reading a patient only touches the
+index pages visited by the binary search and the bytes of that patient's
+rows, no matter how large the table grows. ``StoreBuilder`` writes the same
+layout from a stream of chunks, for tables too large to load at once.
+
+Each bucket's rollups (see ``rollups.py``) are written alongside it, one
+store per level under ``rollups/``, and opened as ``PatientRollups``. So
+are its latest ``LATEST_N`` rows per measurement (see ``latest.py``), under
+``latest_<N>/`` so that a different N needs a rebuild.
+
+A ``manifest.json`` next to the index records the store's latest time (its
+high-water mark), so it is known without reading the buckets, plus whatever
+the caller adds (the loader records which bytes of the CSV the store holds).
+Rows appended later are written as segments under ``segments/``: stores
+with the same layout (each with its own rollups and latest rows) listed in
+the manifest. ``add_segment`` merges the newest segments while they are no
+larger than the one before them, so there are about log2 of the number of
+folds of them and every appended row is rewritten about as many times.
+"""
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from latest import LATEST_N, latest
+from patient_index import PatientIndex, PatientRows, sort_by_patient
+from rollups import DAILY, ROLLUP_LEVELS, rollup
+
+
+N_BUCKETS = 64
+# rows per bucket of a segment, which bounds the memory of merging segments
+SEGMENT_BUCKET_ROWS = 500_000
+INDEX_DTYPE = np.dtype([
+    ('patient_id', 'i8'),
+    ('bucket', 'i4'),
+    ('start', 'i8'),
+    ('end', 'i8'),
+])
+
+
+def bucket_path(root, bucket):
+    return os.path.join(root, f'bucket_{bucket:04d}.arrow')
+
+
+def index_path(root):
+    return os.path.join(root, 'index.npy')
+
+
+def manifest_path(root):
+    return os.path.join(root, 'manifest.json')
+
+
+def read_manifest(root):
+    """The manifest of a store, None if it has none"""
+    try:
+        with open(manifest_path(root)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(root, manifest):
+    """Replace a store's manifest in one step, so readers see the old or the new one"""
+    tmp = manifest_path(root) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, manifest_path(root))
+
+
+def format_time(value):
+    return None if pd.isna(value) else pd.Timestamp(value).isoformat()
+
+
+def write_bucket(root, bucket, df, time_col):
+    """Write one bucket sorted by (patient_id, time) and return its index entries"""
+    return write_sorted(root, bucket, sort_by_patient(df, time_col))
+
+
+def write_sorted(root, bucket, df):
+    """Write one bucket already sorted by patient_id and return its index entries"""
+    table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+    with pa.OSFile(bucket_path(root, bucket), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    index = PatientIndex(df['patient_id'].to_numpy())
+    entries = np.empty(len(index), INDEX_DTYPE)
+    entries['patient_id'] = index.ids
+    entries['bucket'] = bucket
+    entries['start'] = index.offsets[:-1]
+    entries['end'] = index.offsets[1:]
+    return entries
+
+
+def rollup_root(root, level):
+    return os.path.join(root, 'rollups', level)
+
+
+def write_rollups(root, bucket, df, time_col):
+    """Write one bucket's rollups at every level, returns their index entries by level"""
+    entries = {}
+    for level, width in ROLLUP_LEVELS.items():
+        os.makedirs(rollup_root(root, level), exist_ok=True)
+        entries[level] = write_bucket(rollup_root(root, level), bucket, rollup(df, time_col, width), 'time')
+    return entries
+
+
+def latest_root(root, n=LATEST_N):
+    return os.path.join(root, f'latest_{n}')
+
+
+def write_latest(root, bucket, df, time_col):
+    """Write one bucket's latest rows per measurement, returns their index entries"""
+    os.makedirs(latest_root(root), exist_ok=True)
+    return write_sorted(latest_root(root), bucket, latest(df, time_col))
+
+
+def write_indexes(root, entries, rollup_entries, latest_entries, levels=None):
+    """Index of the table buckets, the latest rows and the rollup ``levels``
+
+    By default every level. The other levels are removed.
+    """
+    write_index(root, entries)
+    write_index(latest_root(root), latest_entries)
+    by_level = {level: [bucket_entries[level] for bucket_entries in rollup_entries] for level in ROLLUP_LEVELS}
+    kept = ROLLUP_LEVELS if levels is None else levels
+    for level in ROLLUP_LEVELS:
+        if level in kept:
+            write_index(rollup_root(root, level), by_level[level])
+        else:
+            shutil.rmtree(rollup_root(root, level), ignore_errors=True)
+
+
+def write_index(root, entries):
+    index = np.concatenate(entries) if entries else np.empty(0, INDEX_DTYPE)
+    index.sort(order='patient_id')
+    np.save(index_path(root), index)
+
+
+def replace_dir(tmp, root):
+    shutil.rmtree(root, ignore_errors=True)
+    os.replace(tmp, root)
+
+
+def make_tmp(root):
+    tmp = root + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    return tmp
+
+
+def build_store(root, df, time_col, n_buckets=N_BUCKETS, levels=None, manifest=None):
+    """Write a patient-partitioned store for one fact table into ``root``
+
+    ``levels`` are the rollup levels to keep (by default every level) and ``manifest`` is added to the store's manifest.
+    """
+    tmp = make_tmp(root)
+
+    buckets = df['patient_id'].to_numpy() % n_buckets
+    entries, rollup_entries, latest_entries = [], [], []
+    # a table without rows still writes bucket 0, which holds its columns
+    for bucket, part in df.groupby(buckets, sort=True) if len(df) else [(0, df)]:
+        entries.append(write_bucket(tmp, int(bucket), part, time_col))
+        rollup_entries.append(write_rollups(tmp, int(bucket), part, time_col))
+        latest_entries.append(write_latest(tmp, int(bucket), part, time_col))
+    write_indexes(tmp, entries, rollup_entries, latest_entries, levels)
+    write_manifest(tmp, {'max_time': format_time(df[time_col].max()), **(manifest or {})})
+    replace_dir(tmp, root)
+
+
+def chunk_schema(schema):
+    """Schema every chunk is cast to, so dictionary index widths cannot drift"""
+    fields = [
+        pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type))
+        if pa.types.is_dictionary(field.type) else field
+        for field in schema
+    ]
+    return pa.schema(fields)
+
+
+class StoreBuilder:
+    """Builds a store chunk by chunk without holding the whole table in memory
+
+    ``add`` splits each chunk by bucket and spills the pieces to disk;
+    ``finish`` then loads, sorts and writes one bucket at a time, so peak
+    memory is one chunk or one bucket, whichever is larger.
+    """
+
+    def __init__(self, root, time_col, n_buckets=N_BUCKETS, levels=None):
+        self.root = root
+        self.time_col = time_col
+        self.n_buckets = n_buckets
+        self.levels = levels
+        self.tmp = make_tmp(root)
+        self.schema = None
+        self.chunks = 0
+
+    def spill_dir(self, bucket):
+        return os.path.join(self.tmp, 'spill', f'{bucket:04d}')
+
+    def add(self, df):
+        """Spill one chunk of rows into its buckets, returns the chunk as Arrow"""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.schema is None:
+            self.schema = chunk_schema(table.schema)
+        table = table.cast(self.schema)
+
+        buckets = df['patient_id'].to_numpy() % self.n_buckets
+        order = np.argsort(buckets, kind='stable')
+        bounds = np.searchsorted(buckets[order], np.arange(self.n_buckets + 1))
+        spilled = table.take(order)
+        for bucket in np.flatnonzero(np.diff(bounds)):
+            os.makedirs(self.spill_dir(bucket), exist_ok=True)
+            path = os.path.join(self.spill_dir(bucket), f'{self.chunks:06d}.arrow')
+            piece = spilled.slice(bounds[bucket], bounds[bucket + 1] - bounds[bucket])
+            with pa.OSFile(path, 'wb') as sink:
+                with pa.ipc.new_file(sink, self.schema) as writer:
+                    writer.write_table(piece)
+        self.chunks += 1
+        return table
+
+    def read_spill(self, bucket):
+        spill_dir = self.spill_dir(bucket)
+        if not os.path.isdir(spill_dir):
+            return self.schema.empty_table()
+        pieces = []
+        for name in sorted(os.listdir(spill_dir)):
+            with pa.memory_map(os.path.join(spill_dir, name), 'r') as source:
+                pieces.append(pa.ipc.open_file(source).read_all())
+        return pa.concat_tables(pieces).unify_dictionaries().combine_chunks()
+
+    def finish(self, progress=None, manifest=None):
+        """Sort every spilled bucket into its final file and write the index and manifest"""
+        entries, rollup_entries, latest_entries, maxima = [], [], [], []
+        spill_root = os.path.join(self.tmp, 'spill')
+        buckets = sorted(int(name) for name in os.listdir(spill_root)) if os.path.isdir(spill_root) else []
+        # a table without rows still writes bucket 0, which holds its columns
+        buckets = buckets or [0]
+        for i, bucket in enumerate(buckets):
+            df = self.read_spill(bucket).to_pandas()
+            entries.append(write_bucket(self.tmp, bucket, df, self.time_col))
+            rollup_entries.append(write_rollups(self.tmp, bucket, df, self.time_col))
+            latest_entries.append(write_latest(self.tmp, bucket, df, self.time_col))
+            maxima.append(df[self.time_col].max())
+            shutil.rmtree(self.spill_dir(bucket), ignore_errors=True)
+            if progress:
+                progress((i + 1) / len(buckets))
+        shutil.rmtree(spill_root, ignore_errors=True)
+        write_indexes(self.tmp, entries, rollup_entries, latest_entries, self.levels)
+        max_time = max((value for value in maxima if pd.notna(value)), default=None)
+        write_manifest(self.tmp, {'max_time': format_time(max_time), **(manifest or {})})
+        replace_dir(self.tmp, self.root)
+
+
+def segment_root(root, name):
+    return os.path.join(root, 'segments', name)
+
+
+def segment_buckets(n_rows):
+    return max(math.ceil(n_rows / SEGMENT_BUCKET_ROWS), 1)
+
+
+def new_segment(root):
+    """Root of a segment of the store at ``root`` that is not used yet"""
+    segments_dir = os.path.join(root, 'segments')
+    names = os.listdir(segments_dir) if os.path.isdir(segments_dir) else []
+    number = max((int(name.split('.')[0]) for name in names), default=0) + 1
+    return segment_root(root, f'{number:06d}')
+
+
+def merge_stores(root, stores, time_col, levels):
+    """Write the rows of ``stores`` into one store at ``root``, one bucket at a time"""
+    n_rows = sum(store.n_rows for store in stores)
+    builder = StoreBuilder(root, time_col, segment_buckets(n_rows), levels)
+    for store in stores:
+        for bucket in np.unique(store.index['bucket']):
+            builder.add(store.bucket(int(bucket)).to_pandas())
+    builder.finish()
+    return PatientStore(root)
+
+
+def add_segment(root, segments, df, time_col, levels):
+    """Write ``df`` as a new segment of the store at ``root``, returns its segments
+
+    ``segments`` are the store's open segments, oldest first. While the
+    newest segment is no larger than the one before it the two are merged.
+    The caller lists the returned segments in the manifest with
+    ``save_segments``.
+    """
+    root_new = new_segment(root)
+    build_store(root_new, df, time_col, segment_buckets(len(df)), levels)
+    segments = [*segments, PatientStore(root_new)]
+    while len(segments) > 1 and segments[-2].n_rows <= segments[-1].n_rows:
+        segments[-2:] = [merge_stores(new_segment(root), segments[-2:], time_col, levels)]
+    return segments
+
+
+def save_segments(root, segments, **fields):
+    """List ``segments`` (and ``fields``) in the store's manifest and remove the segments it no longer lists"""
+    names = [os.path.basename(segment.root) for segment in segments]
+    write_manifest(root, {**read_manifest(root), **fields, 'segments': names})
+    for name in os.listdir(os.path.join(root, 'segments')):
+        if name not in names:
+            # a segment still mapped elsewhere cannot be removed on Windows, the next fold retries
+            shutil.rmtree(segment_root(root, name), ignore_errors=True)
+
+
+class PatientStore:
+    """Read-only, memory-mapped view of a store written by ``build_store``"""
+
+    def __init__(self, root):
+        self.root = root
+        self.index = np.load(index_path(root), mmap_mode='r')
+        self.ids = self.index['patient_id']
+        self.manifest = read_manifest(root) or {}
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_rows(self):
+        return int((self.index['end'] - self.index['start']).sum())
+
+    @property
+    def max_time(self):
+        """Latest time in the store, from its manifest"""
+        max_time = self.manifest.get('max_time')
+        return None if max_time is None else pd.Timestamp(max_time)
+
+    def __contains__(self, pid):
+        i = np.searchsorted(self.ids, pid)
+        return i < len(self.ids) and self.ids[i] == pid
+
+    def bucket(self, bucket):
+        """Arrow table backed by the memory-mapped bucket file"""
+        if bucket not in self.buckets:
+            source = pa.memory_map(bucket_path(self.root, bucket), 'r')
+            self.buckets[bucket] = pa.ipc.open_file(source).read_all()
+        return self.buckets[bucket]
+
+    def rows(self, pid):
+        """One patient's rows as a DataFrame, only that slice is read from disk"""
+        i = np.searchsorted(self.ids, pid)
+        if i == len(self.ids) or self.ids[i] != pid:
+            return self.empty()
+        entry = self.index[i]
+        start, end = int(entry['start']), int(entry['end'])
+        return self.bucket(int(entry['bucket'])).slice(start, end - start).to_pandas()
+
+    def empty(self):
+        """A frame with the store's columns and no rows"""
+        if len(self.index):
+            bucket = int(self.index[0]['bucket'])
+        else:
+            # a store without rows still has bucket files, e.g. bucket 0 of an empty table
+            bucket = min(int(name[len('bucket_'):-len('.arrow')])
+                         for name in os.listdir(self.root) if name.startswith('bucket_'))
+        return self.bucket(bucket).schema.empty_table().to_pandas()
+
+    def latest(self):
+        """The latest rows per measurement written alongside this store"""
+        return PatientStore(latest_root(self.root))
+
+    def segments(self):
+        """The segments of rows appended after the store was built, oldest first"""
+        return [PatientStore(segment_root(self.root, name)) for name in self.manifest.get('segments', [])]
+
+    def rollups(self):
+        """The rollup levels written alongside this store"""
+        return PatientRollups({
+            level: PatientStore(rollup_root(self.root, level))
+            for level in ROLLUP_LEVELS if os.path.exists(index_path(rollup_root(self.root, level)))
+        })
+
+
+class PatientRollups:
+    """Every rollup level of one table, each indexed by patient
+
+    Levels are in-memory ``PatientRows``, or memory-mapped ``PatientStore``s
+    for tables built into a patient store.
+    """
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    @classmethod
+    def build(cls, df, time_col, levels=None):
+        """In-memory rollups of a table at ``levels``, by default every level"""
+        return cls({
+            level: PatientRows(rollup(df, time_col, ROLLUP_LEVELS[level]), 'time')
+            for level in (ROLLUP_LEVELS if levels is None else levels)
+        })
+
+    def __contains__(self, pid):
+        return pid in self.levels[DAILY]
+
+    @property
+    def nbytes(self):
+        return sum(
+            int(rows.frame.memory_usage(deep=True).sum()) + rows.index.nbytes
+            for rows in self.levels.values() if isinstance(rows, PatientRows)
+        )
+
+    def rows(self, pid, level):
+        """One patient's buckets at one level"""
+        return self.levels[level].rows(pid)
@@ -0,0 +1,87 @@
+"""Background warming of the patient chart while a patient is selected.
+
+Selecting a row of the patient list submits the chart's data and figures
+to a small thread pool shared by every session, so they are already in the
+shared caches when "Go to Patient Chart" is clicked. Each session has at
+most one prefetch: selecting another patient, or clearing the selection,
+cancels it. A prefetch runs its steps one after another and stops early
+once it is cancelled or older than ``PREFETCH_TTL_SECONDS``, so abandoned
+selections never queue up work.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+
+PREFETCH_WORKERS = 2
+PREFETCH_TTL_SECONDS = 30
+
+
+class Prefetch:
+    """One session's pending warm-up of a patient's chart"""
+
+    def __init__(self, pid, steps, ttl=PREFETCH_TTL_SECONDS):
+        self.pid = pid
+        self.steps = steps
+        self.deadline = time.monotonic() + ttl
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def expired(self):
+        return time.monotonic() > self.deadline
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def run(self):
+        """Run the steps until one of them is cancelled or expires, returns how many ran"""
+        for i, step in enumerate(self.steps):
+            if self.cancelled.is_set() or self.expired():
+                return i
+            step()
+        return len(self.steps)
+
+
+@st.cache_resource
+def get_prefetch_pool():
+    """The process-wide prefetch thread pool"""
+    return ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix='prefetch')
+
+
+def prefetch(pid, steps):
+    """Warm one patient's chart in the background, replacing this session's previous prefetch"""
+    current = st.session_state.get('prefetch')
+    if current is not None and current.pid == pid and not current.cancelled.is_set() and not current.expired():
+        return current
+    cancel_prefetch()
+    task = Prefetch(pid, steps)
+    task.future = get_prefetch_pool().submit(task.run)
+    st.session_state.prefetch = task
+    return task
+
+
+def cancel_prefetch():
+    """Cancel this session's prefetch, if it has one"""
+    task = st.session_state.pop('prefetch', None)
+    if task is not None:
+        task.cancel()
+
+
+def join_prefetch(pid):
+    """Wait for this session's prefetch of ``pid`` if it is already running, so its work is not repeated"""
+    task = st.session_state.get('prefetch')
+    if task is None or task.pid != pid or task.cancelled.is_set():
+        return
+    if task.future.cancel():
+        # still queued behind other sessions' prefetches, the page builds its charts without waiting
+        task.cancelled.set()
+        return
+    try:
+        task.future.result(timeout=max(task.deadline - time.monotonic(), 0))
+    except Exception:
+        # the page builds whatever the prefetch did not, and reports its own errors
+        pass
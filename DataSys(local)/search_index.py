@@ -0,0 +1,212 @@
+"""Search indexes for the patient list.
+
+Both are built once per table and shared across sessions.
+
+``IdIndex`` keeps the ids as strings with a sorted order, so a prefix is a
+binary-searched range, and an n-gram index (every 3-character substring ->
+sorted row positions), so a substring query intersects a few posting lists
+and only checks the remaining candidates. Nothing is converted to strings
+per keystroke.
+
+``TextIndex`` is an inverted index over a free-text column such as
+diagnosis_description. Each distinct text is tokenized once; a query
+keeps the texts containing every term (the last one as a prefix, so
+results update while typing), ranks them with BM25 and expands them to
+row positions.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+
+NGRAM = 3
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class IdIndex:
+    """Prefix and substring lookups over an id column, returning row positions"""
+
+    def __init__(self, ids, n=NGRAM):
+        self.n = n
+        self.strings = np.asarray(pd.Series(ids).astype(str).str.lower(), dtype=str)
+        self.order = np.argsort(self.strings, kind='stable').astype(np.int32)
+
+        # characters numbered by their place in the alphabet, 0 is the padding past an id's end
+        width = self.strings.dtype.itemsize // 4
+        chars = self.strings.view(np.uint32).reshape(len(self.strings), width)
+        self.alphabet = np.union1d([0], chars)
+        rank_dtype = np.uint8 if len(self.alphabet) <= 256 else np.uint32
+        # one contiguous array per character position, so scans read memory in order
+        self.columns = np.ascontiguousarray(np.searchsorted(self.alphabet, chars).T.astype(rank_dtype))
+        self.grams, self.offsets, self.rows = self.build_postings()
+
+    def __len__(self):
+        return len(self.strings)
+
+    @property
+    def nbytes(self):
+        arrays = [self.strings, self.order, self.columns, self.grams, self.offsets, self.rows]
+        return sum(a.nbytes for a in arrays)
+
+    def build_postings(self):
+        """Sorted n-gram codes, and the [offsets[i], offsets[i+1]) rows of each"""
+        n_rows = len(self.strings)
+        keys = []
+        for k in range(len(self.columns) - self.n + 1):
+            window = self.columns[k:k + self.n]
+            valid = np.flatnonzero(window[-1] != 0)
+            keys.append(self.encode(window[:, valid]) * n_rows + valid)
+        # (gram, row) pairs sorted in one pass, then grams repeated within an id dropped
+        keys = np.sort(np.concatenate(keys)) if keys else np.empty(0, np.int64)
+        keys = keys[np.append(True, keys[1:] != keys[:-1])] if len(keys) else keys
+        codes, rows = np.divmod(keys, max(n_rows, 1))
+
+        starts = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate([[0], starts]) if len(codes) else starts
+        return codes[starts], np.append(starts, len(codes)), rows.astype(np.int32)
+
+    def encode(self, ranks):
+        """One int64 per column of n character ranks"""
+        code = np.zeros(ranks.shape[1], np.int64)
+        for rank in ranks:
+            code = code * len(self.alphabet) + rank
+        return code
+
+    def ranks(self, text):
+        """Character ranks of a query, None if a character never occurs in any id"""
+        chars = np.frombuffer(text.encode('utf-32-le'), np.uint32)
+        ranks = np.searchsorted(self.alphabet, chars)
+        if (ranks >= len(self.alphabet)).any() or (self.alphabet[np.minimum(ranks, len(self.alphabet) - 1)] != chars).any():
+            return None
+        return ranks
+
+    def posting(self, gram):
+        ranks = self.ranks(gram)
+        if ranks is None:
+            return np.empty(0, np.int32)
+        code = self.encode(ranks[:, None])[0]
+        i = np.searchsorted(self.grams, code)
+        if i == len(self.grams) or self.grams[i] != code:
+            return np.empty(0, np.int32)
+        return self.rows[self.offsets[i]:self.offsets[i + 1]]
+
+    def prefix(self, query):
+        """Positions of the ids starting with ``query``, in row order"""
+        query = query.lower()
+        if not query:
+            return np.arange(len(self.strings))
+        if len(query) > len(self.columns):
+            return np.empty(0, np.int32)
+        upper = query[:-1] + chr(ord(query[-1]) + 1)
+        lo, hi = np.searchsorted(self.strings, [query, upper], sorter=self.order)
+        return np.sort(self.order[lo:hi])
+
+    def contains(self, query):
+        """Positions of the ids containing ``query``, in row order"""
+        query = query.lower()
+        if not query:
+            return np.arange(len(self.strings))
+        if len(query) < self.n:
+            return self.match(np.arange(len(self.strings)), query)
+        candidates = None
+        for gram in {query[i:i + self.n] for i in range(len(query) - self.n + 1)}:
+            posting = self.posting(gram)
+            candidates = posting if candidates is None else np.intersect1d(candidates, posting, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+        # the n-grams can all occur without the whole query occurring
+        return self.match(candidates, query)
+
+    def match(self, rows, query):
+        """The ``rows`` whose id contains ``query``"""
+        ranks = self.ranks(query)
+        width = len(self.columns)
+        if ranks is None or len(ranks) > width:
+            return rows[:0]
+        columns = self.columns if len(rows) == len(self.strings) else self.columns[:, rows]
+        hits = np.zeros(len(rows), bool)
+        for k in range(width - len(ranks) + 1):
+            hit = columns[k] == ranks[0]
+            for i in range(1, len(ranks)):
+                hit &= columns[k + i] == ranks[i]
+            hits |= hit
+        return rows[hits]
+
+
+def tokenize(text):
+    return TOKEN.findall(str(text).lower())
+
+
+class TextIndex:
+    """Ranked multi-term AND search over a text column, returning row positions"""
+
+    def __init__(self, texts):
+        codes, values = pd.factorize(pd.Series(texts))
+        counts = np.bincount(codes[codes >= 0], minlength=len(values))
+        # rows grouped by text, missing texts (code -1) sort first and are never matched
+        self.row_order = np.argsort(codes, kind='stable').astype(np.int32)
+        self.value_offsets = np.count_nonzero(codes < 0) + np.concatenate([[0], np.cumsum(counts)])
+
+        postings = {}
+        lengths = np.zeros(len(values), np.float64)
+        for value, text in enumerate(values):
+            tokens = tokenize(text)
+            lengths[value] = len(tokens)
+            for token in tokens:
+                postings.setdefault(token, {}).setdefault(value, 0)
+                postings[token][value] += 1
+
+        self.vocab = np.array(sorted(postings), dtype=str)
+        self.post_offsets = np.zeros(len(self.vocab) + 1, np.int64)
+        self.post_offsets[1:] = np.cumsum([len(postings[term]) for term in self.vocab])
+        self.post_values = np.array([v for term in self.vocab for v in postings[term]], np.int32)
+        tf = np.array([n for term in self.vocab for n in postings[term].values()], np.float64)
+
+        # BM25 weight of each (term, text) pair, with document frequencies counted in rows
+        n_rows = max(int(counts.sum()), 1)
+        df = np.add.reduceat(counts[self.post_values], self.post_offsets[:-1]) if len(tf) else np.zeros(0)
+        idf = np.log1p((n_rows - df + 0.5) / (df + 0.5))
+        mean_length = max(np.average(lengths, weights=counts) if counts.sum() else 0, 1)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[self.post_values] / mean_length)
+        self.post_weights = np.repeat(idf, np.diff(self.post_offsets)) * tf * (BM25_K1 + 1) / (tf + norm)
+        self.n_values = len(values)
+
+    @property
+    def nbytes(self):
+        arrays = [self.row_order, self.value_offsets, self.vocab, self.post_offsets, self.post_values, self.post_weights]
+        return sum(a.nbytes for a in arrays)
+
+    def term_range(self, term, prefix=False):
+        """[lo, hi) range of vocabulary entries equal to, or starting with, ``term``"""
+        upper = term[:-1] + chr(ord(term[-1]) + 1) if prefix else term
+        lo = np.searchsorted(self.vocab, term, 'left')
+        hi = np.searchsorted(self.vocab, upper, 'left' if prefix else 'right')
+        return lo, hi
+
+    def search(self, query):
+        """Positions of the rows whose text contains every term, best match first
+
+        Returns None when the query has no terms, meaning no text filter.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return None
+        scores = np.zeros(self.n_values)
+        matched = np.zeros(self.n_values, np.int32)
+        for i, term in enumerate(terms):
+            lo, hi = self.term_range(term, prefix=i == len(terms) - 1)
+            start, stop = self.post_offsets[lo], self.post_offsets[hi]
+            values = self.post_values[start:stop]
+            np.add.at(scores, values, self.post_weights[start:stop])
+            matched[np.unique(values)] += 1
+
+        hits = np.flatnonzero(matched == len(terms))
+        ranked = hits[np.argsort(-scores[hits], kind='stable')]
+        slices = [self.row_order[self.value_offsets[v]:self.value_offsets[v + 1]] for v in ranked]
+        return np.concatenate(slices) if slices else np.empty(0, np.int32)
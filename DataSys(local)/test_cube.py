@@ -0,0 +1,57 @@
+import pandas as pd
+
+from bitmaps import DistinctCounts
+from cube import AdmissionsCube
+from derived import AGE_LABELS, add_derived_columns
+from loader import compact
+
+
+def admissions():
+    return add_derived_columns(pd.DataFrame({
+        'admission_id': [1, 2, 3, 4],
+        'patient_id': [10, 11, 12, 13],
+        'Hospital': ['Alpha', 'Beta', 'Beta', 'Beta'],
+        'admission_location': ['ER', 'ER', 'CLINIC', 'ER'],
+        'admission_type': ['EW', 'EW', 'ELECTIVE', 'EW'],
+        'discharge_location': [None, 'HOME', 'HOME', 'HOSPICE'],
+        'gender': ['F', 'M', 'F', 'M'],
+        'age': [30, 50, 70, 90],
+        'race': ['WHITE', 'ASIAN', 'BLACK', 'WHITE'],
+        'length_of_stay': [1.5, 2.0, 3.25, 1.0],
+        'lace_score': [5, 6, 7, 8],
+        'cci_score': [1, 2, 3, 4],
+    }))
+
+
+def test_breakdown_of_a_hospital_without_values_is_empty():
+    cube = AdmissionsCube(admissions())
+    df = cube.breakdown('discharge_location', 'admissions', 'n', 'Alpha')
+    assert list(df.columns) == ['discharge_location', 'n'] and df.empty
+    beta = cube.breakdown('discharge_location', 'admissions', 'n', 'Beta')
+    assert dict(zip(beta['discharge_location'], beta['n'])) == {'HOME': 2, 'HOSPICE': 1}
+
+
+def test_kpis_of_an_unknown_hospital():
+    kpis = AdmissionsCube(admissions()).kpis('Gamma')
+    assert kpis['patients'] == 0 and kpis['admissions'] == 0
+    assert kpis[['age', 'length_of_stay', 'lace_score', 'cci_score']].isna().all()
+
+
+def test_kpi_means_match_the_filtered_view_on_narrowed_columns():
+    df = add_derived_columns(compact(admissions(), 'fact_admissions')[0])
+    assert df['length_of_stay'].dtype == 'float32'
+    cube, distinct = AdmissionsCube(df), DistinctCounts(df)
+    for hospital in ['Alpha', 'Beta']:
+        kpis = distinct.kpis({'Hospital': [hospital]})
+        assert cube.kpis(hospital)[kpis.index].tolist() == kpis.tolist()
+
+
+def test_age_bands_without_patients_are_zero_bars():
+    df = admissions()
+    cube, distinct = AdmissionsCube(df), DistinctCounts(df)
+    beta = cube.breakdown('age_group', 'patients', 'n', 'Beta')
+    assert beta['age_group'].tolist() == AGE_LABELS and beta['n'].tolist() == [0, 0, 1, 1, 1]
+    filtered = distinct.breakdown('age_group', 'patients', 'n', {'Hospital': ['Beta']})
+    pd.testing.assert_frame_equal(filtered, beta)
+    # the other dimensions list only the values that occur
+    assert cube.breakdown('race_grouped', 'patients', 'n', 'Beta')['race_grouped'].tolist() == ['Asian', 'Black', 'White']
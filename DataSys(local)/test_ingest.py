@@ -0,0 +1,239 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset
+import loader
+import patient_store
+from dataset import TABLES, PatientTable, open_dataset
+from loader import csv_path, has_parquet, has_store, read_csv
+from rollups import DAILY, KEY_COLUMNS, ROLLUP_LEVELS, choose_level, rollup
+
+
+PATIENTS = [1, 2, 3, 4, 5, 6]
+START = pd.Timestamp('2150-01-01')
+
+
+def admissions(ids):
+    n = len(ids)
+    return pd.DataFrame({
+        'admission_id': ids,
+        'patient_id': [PATIENTS[i % len(PATIENTS)] for i in range(n)],
+        'Hospital': ['Alpha', 'Beta'] * (n // 2) + ['Alpha'] * (n % 2),
+        'admission_type': 'EW',
+        'admission_location': 'ER',
+        'discharge_location': 'HOME',
+        'gender': 'F',
+        'age': 60,
+        'race': 'WHITE',
+        'diagnosis_description': 'Heart failure',
+        'length_of_stay': 2.5,
+        'lace_score': 7,
+        'cci_score': 3,
+    })
+
+
+def readings(time_col, names, n, seed, start=START):
+    rng = np.random.default_rng(seed)
+    name_col, value_col = {'vital_time': ('vital_name', 'vital_reading'), 'lab_time': ('lab_type_name', 'lab_value')}[time_col]
+    return pd.DataFrame({
+        'patient_id': rng.choice(PATIENTS, n),
+        'admission_id': 100,
+        name_col: rng.choice(names, n),
+        time_col: start + pd.to_timedelta(np.sort(rng.integers(0, 5 * 86400, n)), unit='s'),
+        value_col: rng.integers(50, 150, n).astype(float),
+    })
+
+
+def write(name, df, mode='w'):
+    df.to_csv(csv_path(name), mode=mode, header=mode == 'w', index=False)
+
+
+@pytest.fixture
+def tables(tmp_path, monkeypatch):
+    """Small CSV tables in a fresh ./tables"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('tables')
+    write('fact_admissions', admissions(list(range(10, 40, 2))))
+    write('fact_vitals', readings('vital_time', ['SBP', 'Heart Rate'], 400, 0))
+    write('fact_lab_results', readings('lab_time', ['Sodium'], 100, 1))
+
+
+def build_store():
+    loader.main([])
+    assert has_store('fact_vitals') and has_store('fact_lab_results')
+
+
+def normalized(df):
+    df = df.reset_index(drop=True)
+    return df.astype({col: object for col in df if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+
+def assert_same_as_fresh(ds):
+    """Per-patient rows, latest rows and rollups match a table loaded from the CSVs as they are now"""
+    for key, table in ds.patient_tables.items():
+        name, time_col = TABLES[key]
+        fresh = PatientTable(read_csv(name), time_col)
+        for pid in PATIENTS:
+            rows = normalized(fresh.rows(pid))
+            pd.testing.assert_frame_equal(normalized(table.rows(pid)), rows, check_dtype=False)
+            pd.testing.assert_frame_equal(
+                normalized(table.latest_rows(pid)), normalized(fresh.latest_rows(pid)), check_dtype=False
+            )
+            for level in table.levels:
+                # bucket order within a patient does not matter, the charts select by measurement
+                buckets = table.rollup_rows(pid, level).sort_values(KEY_COLUMNS)
+                expected = rollup(fresh.rows(pid), time_col, ROLLUP_LEVELS[level])
+                pd.testing.assert_frame_equal(normalized(buckets), normalized(expected), check_dtype=False)
+
+
+def append_late_rows():
+    """Rows tying the latest vital, older than it for another patient, and newer, plus a lower new admission_id"""
+    vitals = read_csv('fact_vitals')
+    last = vitals.loc[vitals['vital_time'].idxmax()]
+    other = next(pid for pid in PATIENTS if pid != last['patient_id'])
+    write('fact_vitals', pd.DataFrame({
+        'patient_id': [last['patient_id'], other, other],
+        'admission_id': 100,
+        'vital_name': 'SBP',
+        'vital_time': [last['vital_time'], last['vital_time'] - pd.Timedelta(seconds=5),
+                       last['vital_time'] + pd.Timedelta(seconds=5)],
+        'vital_reading': [120.0, 121.0, 122.0],
+    }), mode='a')
+    write('fact_lab_results', readings('lab_time', ['Sodium'], 5, 2, START + pd.Timedelta(days=1)), mode='a')
+    write('fact_admissions', admissions([11]), mode='a')
+
+
+@pytest.mark.parametrize('store', [False, True])
+def test_refresh_keeps_late_and_tied_rows(tables, store):
+    if store:
+        build_store()
+    ds = open_dataset()
+    append_late_rows()
+    assert ds.refresh() == {'admissions': 1, 'vitals': 3, 'labs': 5}
+    assert 11 in set(ds.admissions['admission_id'])
+    assert_same_as_fresh(ds)
+    assert ds.refresh() == {}
+
+
+@pytest.mark.parametrize('store', [False, True])
+def test_restart_reads_only_the_appended_bytes(tables, store):
+    if store:
+        build_store()
+    else:
+        loader.main(['fact_admissions'])
+    append_late_rows()
+    # appending does not make the copies stale
+    assert has_parquet('fact_admissions')
+    assert has_store('fact_vitals') == store
+    ds = open_dataset()
+    assert ds.admissions['admission_id'].tolist().count(11) == 1
+    assert_same_as_fresh(ds)
+
+
+def test_store_tail_is_folded_into_segments(tables, monkeypatch):
+    monkeypatch.setattr(dataset, 'FOLD_ROWS', 20)
+    monkeypatch.setattr(patient_store, 'SEGMENT_BUCKET_ROWS', 15)
+    build_store()
+    ds = open_dataset()
+    for seed in range(5):
+        write('fact_vitals', readings('vital_time', ['SBP'], 25, 10 + seed), mode='a')
+        ds.refresh()
+    segments = patient_store.read_manifest(loader.store_path('fact_vitals'))['segments']
+    # five folds of 25 rows, merged while the newest is no larger than the one before
+    assert [patient_store.PatientStore(loader.segment_root(loader.store_path('fact_vitals'), name)).n_rows
+            for name in segments] == [100, 25]
+    assert ds.patient_tables['vitals'].tail is None
+    assert_same_as_fresh(ds)
+
+    # a restart opens the store with its segments and reads nothing again
+    write('fact_vitals', readings('vital_time', ['SBP'], 3, 20), mode='a')
+    restarted = open_dataset()
+    assert len(restarted.patient_tables['vitals'].parts) == 4
+    assert_same_as_fresh(restarted)
+
+
+def test_store_high_water_mark_comes_from_the_manifest(tables):
+    build_store()
+    store = loader.open_store('fact_vitals')
+    assert store.max_time == read_csv('fact_vitals')['vital_time'].max()
+
+
+def test_replaced_csv_keeps_only_unseen_rows(tables):
+    ds = open_dataset()
+    vitals = read_csv('fact_vitals')
+    new = readings('vital_time', ['SBP'], 4, 3)
+    # the replacement is shorter: half the old rows, then new ones
+    write('fact_vitals', pd.concat([vitals.iloc[:150], new]))
+    assert ds.refresh() == {'vitals': 4}
+    for pid in PATIENTS:
+        rows = ds.patient_rows('vitals', pid)
+        assert not rows.duplicated().any()
+
+
+def test_removed_csv_is_skipped(tables):
+    ds = open_dataset()
+    append_late_rows()
+    os.remove(csv_path('fact_lab_results'))
+    assert ds.refresh() == {'admissions': 1, 'vitals': 3}
+
+
+def dense_vitals(days, start=START):
+    """One SBP reading a minute for patient 1"""
+    return pd.DataFrame({
+        'patient_id': 1,
+        'admission_id': 100,
+        'vital_name': 'SBP',
+        'vital_time': start + pd.to_timedelta(np.arange(days * 24 * 60), unit='min'),
+        'vital_reading': 120.0,
+    })
+
+
+@pytest.mark.parametrize('store', [False, True])
+def test_dense_patient_among_sparse_ones_reads_buckets(tables, store):
+    # a few readings each for thousands of patients, so most buckets of every level hold one reading
+    sparse = readings('vital_time', ['SBP', 'Heart Rate'], 20_000, 0)
+    sparse['patient_id'] = np.random.default_rng(1).integers(2, 5000, len(sparse))
+    write('fact_vitals', pd.concat([sparse, dense_vitals(7)]))
+    if store:
+        build_store()
+    ds = open_dataset()
+    week = (START, START + pd.Timedelta(days=7))
+    assert ds.history('vitals', 1, *week)[0] == '1h'
+    assert len(ds.history('vitals', 1, *week)[1]) == 7 * 24
+
+    # a day of readings appended into the tail, then the whole stay
+    write('fact_vitals', dense_vitals(1, START + pd.Timedelta(days=7)), mode='a')
+    ds.refresh()
+    level, rows = ds.history('vitals', 1, *ds.time_span(1))
+    assert level == '1h' and len(rows) == 8 * 24
+    # a sparse patient's few readings are still drawn raw
+    assert ds.history('vitals', 2, *ds.time_span(2))[0] is None
+
+
+def test_choose_level_falls_back_to_a_coarser_kept_level():
+    start, end = START, START + pd.Timedelta(days=7)
+    assert choose_level(start, end, 10_080, ['1d']) == DAILY
+    assert choose_level(start, end, 10_080, ['5min', DAILY]) == DAILY
+    assert choose_level(start, end, 10_080) == '1h'
+    assert choose_level(start, end, 100, ['1d']) is None
+
+
+def test_empty_store_returns_zero_row_frames(tables):
+    vitals = read_csv('fact_vitals')
+    write('fact_vitals', vitals.iloc[0:0])
+    build_store()
+    ds = open_dataset()
+    rows = ds.patient_rows('vitals', 1)
+    assert rows.empty and list(rows.columns) == list(vitals.columns)
+    assert ds.latest_rows('vitals', 1).empty
+    assert ds.patient_tables['vitals'].rollup_rows(1, DAILY).empty
+
+    # a store built from a filtered frame, and rows appended to the empty CSV later
+    patient_store.build_store('filtered', vitals[vitals['patient_id'] > 100], 'vital_time')
+    assert list(patient_store.PatientStore('filtered').rows(1).columns) == list(vitals.columns)
+    write('fact_vitals', vitals, mode='a')
+    ds.refresh()
+    assert_same_as_fresh(ds)
@@ -0,0 +1,10 @@
+from loader import concat_tables
+from patient_list import PatientList
+from test_cube import admissions
+
+
+def test_hospitals_stay_sorted_after_an_append():
+    df = admissions().assign(diagnosis_description='Heart failure').astype({'Hospital': 'category'})
+    appended = df.assign(Hospital='Aardvark', patient_id=99)
+    hospitals = PatientList(concat_tables([df, appended])).hospitals()
+    assert hospitals == ['Aardvark', 'Alpha', 'Beta']
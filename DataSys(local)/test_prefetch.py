@@ -0,0 +1,50 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import streamlit as st
+
+import prefetch
+from prefetch import join_prefetch
+
+
+@pytest.fixture
+def release(monkeypatch):
+    """A prefetch pool with both workers held busy until the test releases them"""
+    pool = ThreadPoolExecutor(prefetch.PREFETCH_WORKERS)
+    release = threading.Event()
+    for _ in range(prefetch.PREFETCH_WORKERS):
+        pool.submit(release.wait)
+    monkeypatch.setattr(prefetch, 'get_prefetch_pool', lambda: pool)
+    st.session_state.clear()
+    yield release
+    release.set()
+    pool.shutdown()
+    st.session_state.clear()
+
+
+def test_join_cancels_a_queued_prefetch_without_waiting(release):
+    ran = []
+    task = prefetch.prefetch(1, [lambda: ran.append(1)])
+    started = time.monotonic()
+    join_prefetch(1)
+    assert time.monotonic() - started < 1
+    assert task.future.cancelled() and task.cancelled.is_set()
+    release.set()
+    assert ran == []
+
+
+def test_join_waits_for_a_running_prefetch(release):
+    release.set()
+    running, ran = threading.Event(), []
+
+    def step():
+        running.set()
+        time.sleep(0.2)
+        ran.append(1)
+
+    task = prefetch.prefetch(1, [step])
+    assert running.wait(5)
+    join_prefetch(1)
+    assert ran == [1] and task.future.result() == 1